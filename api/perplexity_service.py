@@ -1,233 +1,506 @@
 import os
+import re
+import random
+import logging
+import threading
+import time
+from functools import lru_cache
+import orjson
 import requests
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from utils.cache import TTLCache
+from utils.metrics import Metrics
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Connection settings are read once at import; every instance shares them
+API_KEY = os.getenv("PERPLEXITY_API_KEY")
+BASE_URL = "https://api.perplexity.ai"
+HEADERS = {
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json"
+}
+
+# Shared worker pool so independent, network-bound API calls can overlap
+# instead of running back to back on the Streamlit script thread.
+_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="perplexity")
+
+# System prompts are frozen so every request starts with a byte-identical
+# prefix the provider can reuse across calls
+SYSTEM_OPENER = "You are a creative storyteller who crafts engaging narratives. Create vivid, immersive story openings that incorporate cultural elements naturally. Keep responses to 2-3 paragraphs."
+SYSTEM_CONTINUE = "You are continuing a collaborative story. Maintain narrative consistency and incorporate cultural elements naturally. Respond with 2-3 paragraphs that advance the plot."
+SYSTEM_BRANCH = "You are a creative storyteller generating branching narrative options. Provide exactly 3 distinct, engaging choices."
+SYSTEM_SUMMARY = "You summarize collaborative stories. Reply with one paragraph of at most 80 words covering the characters, setting and key plot points so far."
+
+# Continuation context: once a story is longer than SUMMARIZE_AFTER entries,
+# only the last RAW_TURNS are sent verbatim and older ones as a rolling summary
+SUMMARIZE_AFTER = 4
+RAW_TURNS = 2
+MAX_RAW_CONTEXT = 6
+
+# (connect, read) seconds for completion requests; connecting is cheap to
+# retry, so fail fast there and leave room for the model to answer
+REQUEST_TIMEOUT = (5, 30)
+
+# Usage figures are logged for operators once per this many completions
+METRICS_LOG_EVERY = 50
+
+# Matches "Option N: text" lines in a branching-options completion; [ \t]
+# rather than \s so an empty option never swallows the line after it
+OPTION_RE = re.compile(r'^[ \t]*Option[ \t]*([123])[ \t]*:[ \t]*(.+?)[ \t\r]*$', re.MULTILINE)
+
+@lru_cache(maxsize=512)
+def _compose_story_prompt(user_prompt: str, cultural_context: str) -> str:
+    """Build (and reuse) the opener prompt for a prompt/context pair."""
+    return (f"Create an engaging story opening based on: {user_prompt}"
+            f"\n\nIncorporate these cultural elements naturally: {cultural_context}")
+
+@lru_cache(maxsize=512)
+def _culture_suffix(cultural_context: str) -> str:
+    """Build (and reuse) the context suffix appended to each continuation input."""
+    return f"\n\nConsider incorporating: {cultural_context}"
+
+class PerplexityAPIError(Exception):
+    """A streaming completion that failed or returned an API error."""
+
+class _JitterRetry(Retry):
+    """Exponential backoff with full jitter, capped at a few seconds."""
+    
+    MAX_BACKOFF = 8
+    
+    def get_backoff_time(self) -> float:
+        backoff = min(self.MAX_BACKOFF, super().get_backoff_time())
+        return random.uniform(0, backoff)
+    
+    def get_retry_after(self, response) -> Optional[float]:
+        # A long Retry-After would block the Streamlit rerun; cap it as well
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(self.MAX_BACKOFF, retry_after)
+
 class PerplexityService:
     def __init__(self):
-        self.api_key = os.getenv("PERPLEXITY_API_KEY")
-        self.base_url = "https://api.perplexity.ai"
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        self.api_key = API_KEY
+        self.base_url = BASE_URL
+        self.headers = HEADERS
+        
+        # Persistent session so every call reuses pooled keep-alive connections
+        # instead of paying a fresh TCP + TLS handshake per request
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # Completions are billed, non-idempotent POSTs: retry only when the
+        # request cannot have been processed (connection never established,
+        # 429 / 503 rejections), never after a read timeout or other 5xx.
+        # Backoff is jittered and Retry-After is honoured up to MAX_BACKOFF
+        retry = _JitterRetry(
+            total=3,
+            connect=3,
+            read=0,
+            other=0,
+            backoff_factor=0.5,
+            status_forcelist=(429, 503),
+            allowed_methods=frozenset({"HEAD", "POST"}),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=retry)
+        self.session.mount("https://", adapter)
+        
+        # Open the first pooled connection ahead of the first real request
+        if self.api_key:
+            _EXECUTOR.submit(self.warm_up)
+        
+        # Rolling story summaries keyed by the last history entry they cover
+        self._summaries = TTLCache(maxsize=512, ttl=3600)
+        self._summaries_pending = set()
+        self._summaries_lock = threading.Lock()
+        
+        # Token spend, errors and latency for tuning limits
+        self.metrics = Metrics()
+    
+    def warm_up(self):
+        """Complete the TCP + TLS handshake so the pool holds a live connection."""
+        try:
+            self.session.head(self.base_url, timeout=5)
+        except requests.RequestException:
+            pass  # Warming is best effort; real requests connect on demand
+    
+    def submit(self, method: Callable, *args, **kwargs) -> Future:
+        """Run a service method on the shared worker pool and return its Future.
+        
+        Lets callers fan out independent requests, e.g.
+        ``service.submit(service.generate_branching_options, story, context)``,
+        and collect the results with ``Future.result()``.
+        """
+        return _EXECUTOR.submit(method, *args, **kwargs)
+    
+    def get_metrics(self) -> Dict:
+        """Return token, error and latency figures for this service."""
+        return self.metrics.snapshot()
+    
+    def _log_metrics(self):
+        """Log the process-wide usage figures; they are not shown to visitors."""
+        usage = self.get_metrics()
+        counters = usage["counters"]
+        latency = usage["timings"].get("request_seconds") or {"p50": 0.0, "p95": 0.0}
+        logger.info(
+            "Perplexity usage: %d completions, %d prompt + %d completion tokens, "
+            "%d errors, request p50 %.1fs p95 %.1fs",
+            counters.get("completions", 0),
+            counters.get("prompt_tokens", 0),
+            counters.get("completion_tokens", 0),
+            counters.get("errors", 0),
+            latency["p50"],
+            latency["p95"]
+        )
     
     def generate_story_opener(self, prompt: str, cultural_context: str = "") -> Dict:
         """Generate initial story content based on user prompt and cultural context."""
+        payload = self._opener_payload(prompt, cultural_context)
+        return self._post_chat(payload)
+    
+    def continue_story(self, story_history: List[Dict], user_input: str, cultural_context: str = "") -> Dict:
+        """Continue the story based on history and new user input."""
         try:
-            enhanced_prompt = self._create_story_prompt(prompt, cultural_context)
-            
-            payload = {
-                "model": "sonar-pro",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a creative storyteller who crafts engaging narratives. Create vivid, immersive story openings that incorporate cultural elements naturally. Keep responses to 2-3 paragraphs."
-                    },
-                    {
-                        "role": "user",
-                        "content": enhanced_prompt
-                    }
-                ],
-                "max_tokens": 300,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "success": True,
-                    "content": data["choices"][0]["message"]["content"],
-                    "usage": data.get("usage", {})
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"API Error: {response.status_code} - {response.text}"
-                }
-                
+            payload = self._continuation_payload(story_history, user_input, cultural_context)
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Request failed: {str(e)}"
             }
+        
+        return self._post_chat(payload)
     
-    def continue_story(self, story_history: List[Dict], user_input: str, cultural_context: str = "") -> Dict:
-        """Continue the story based on history and new user input."""
-        try:
-            messages = [
+    def generate_branching_options(self, current_story: str, cultural_context: str = "") -> Dict:
+        """Generate multiple story continuation options."""
+        prompt = f"""Based on this story:
+
+{current_story}
+
+Generate 3 distinct continuation options that:
+1. Advance the plot in different directions
+2. Incorporate these cultural elements: {cultural_context}
+3. Each option should be 1-2 sentences
+
+Format as:
+Option 1: [continuation]
+Option 2: [continuation]  
+Option 3: [continuation]"""
+
+        payload = {
+            "model": "sonar-pro",
+            "messages": [
                 {
                     "role": "system",
-                    "content": "You are continuing a collaborative story. Maintain narrative consistency and incorporate cultural elements naturally. Respond with 2-3 paragraphs that advance the plot."
+                    "content": SYSTEM_BRANCH
+                },
+                {
+                    "role": "user",
+                    "content": prompt
                 }
-            ]
-            
-            # Build conversation history ensuring proper alternation
-            conversation_history = []
-            for entry in story_history[-6:]:  # Last 6 turns for context
-                if entry["type"] == "user":
-                    conversation_history.append({
-                        "role": "user",
-                        "content": entry["content"]
-                    })
-                elif entry["type"] == "assistant":
-                    conversation_history.append({
-                        "role": "assistant", 
-                        "content": entry["content"]
-                    })
-            
-            # Ensure we end with a user message for the API
-            if conversation_history and conversation_history[-1]["role"] == "assistant":
-                # Remove the last assistant message to avoid ending with assistant
-                conversation_history.pop()
-            
-            # Add conversation history to messages
-            messages.extend(conversation_history)
-            
-            # Add current user input with cultural context
-            enhanced_input = self._enhance_with_culture(user_input, cultural_context)
-            messages.append({
-                "role": "user",
-                "content": enhanced_input
-            })
-            
-            # Validate message sequence
-            validated_messages = self._validate_message_sequence(messages)
-            
-            payload = {
-                "model": "sonar-pro",
-                "messages": validated_messages,
-                "max_tokens": 300,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            ],
+            "max_tokens": 200,
+            "temperature": 0.8
+        }
+        
+        result = self._post_chat(payload)
+        if not result["success"]:
+            return result
+        
+        return {
+            "success": True,
+            "options": self._parse_options(result["content"]),
+            "usage": result["usage"]
+        }
+    
+    def stream_story_opener(self, prompt: str, cultural_context: str = "") -> Iterator[str]:
+        """Stream the story opening as text chunks while it is generated."""
+        payload = self._opener_payload(prompt, cultural_context)
+        yield from self._stream_chat(payload)
+    
+    def stream_continue_story(self, story_history: List[Dict], user_input: str, cultural_context: str = "") -> Iterator[str]:
+        """Stream the story continuation as text chunks while it is generated."""
+        payload = self._continuation_payload(story_history, user_input, cultural_context)
+        yield from self._stream_chat(payload)
+    
+    def _post_chat(self, payload: Dict) -> Dict:
+        """Post a chat completion and return its content, usage or error."""
+        try:
+            with self.metrics.time("request_seconds"):
+                response = self.session.post(
+                    f"{self.base_url}/chat/completions",
+                    data=orjson.dumps(payload),
+                    timeout=REQUEST_TIMEOUT
+                )
             
             if response.status_code == 200:
-                data = response.json()
-                return {
+                data = orjson.loads(response.content)
+                result = {
                     "success": True,
                     "content": data["choices"][0]["message"]["content"],
                     "usage": data.get("usage", {})
                 }
+                self._record_usage(payload, result["usage"])
             else:
+                self.metrics.inc("errors")
                 return {
                     "success": False,
                     "error": f"API Error: {response.status_code} - {response.text}"
                 }
-                
+        
         except Exception as e:
+            self.metrics.inc("errors")
             return {
                 "success": False,
                 "error": f"Request failed: {str(e)}"
             }
+        
+        return result
     
-    def generate_branching_options(self, current_story: str, cultural_context: str = "") -> Dict:
-        """Generate multiple story continuation options."""
+    def _stream_chat(self, payload: Dict) -> Iterator[str]:
+        """Post a chat completion with streaming enabled and yield content deltas.
+        
+        Metrics follow ``_post_chat``: a finished stream is recorded.
+        Failures raise PerplexityAPIError, possibly after some chunks.
+        """
+        # The caller repaints the page between chunks; that time is not API
+        # latency, so the clock only runs while this generator is waiting
+        elapsed = 0.0
+        resumed = time.perf_counter()
         try:
-            prompt = f"""Based on this story:
-
-{current_story}
-
-Generate 3 distinct continuation options that:
-1. Advance the plot in different directions
-2. Incorporate these cultural elements: {cultural_context}
-3. Each option should be 1-2 sentences
-
-Format as:
-Option 1: [continuation]
-Option 2: [continuation]  
-Option 3: [continuation]"""
-
+            response = self.session.post(
+                f"{self.base_url}/chat/completions",
+                data=orjson.dumps({**payload, "stream": True}),
+                timeout=REQUEST_TIMEOUT,
+                stream=True
+            )
+        except requests.RequestException as e:
+            self.metrics.inc("errors")
+            raise PerplexityAPIError(f"Request failed: {str(e)}") from e
+        
+        usage = {}
+        with response:
+            if response.status_code != 200:
+                self.metrics.inc("errors")
+                raise PerplexityAPIError(f"API Error: {response.status_code} - {response.text}")
+            
+            try:
+                # Server-sent events: one "data: {...}" line per chunk
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    
+                    chunk = line[5:].strip()
+                    if chunk == "[DONE]":
+                        break
+                    
+                    data = orjson.loads(chunk)
+                    # Chunks carry the running usage; the last one is the total
+                    usage = data.get("usage") or usage
+                    choices = data.get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        elapsed += time.perf_counter() - resumed
+                        yield delta
+                        resumed = time.perf_counter()
+            except (requests.RequestException, ValueError) as e:
+                # Dropped connections and undecodable chunks mid-stream; the
+                # tokens generated so far are billed all the same
+                self.metrics.inc("errors")
+                self.metrics.inc("prompt_tokens", usage.get("prompt_tokens", 0))
+                self.metrics.inc("completion_tokens", usage.get("completion_tokens", 0))
+                raise PerplexityAPIError(f"Request failed: {str(e)}") from e
+        
+        elapsed += time.perf_counter() - resumed
+        self.metrics.observe("request_seconds", elapsed)
+        self._record_usage(payload, usage)
+    
+    def _record_usage(self, payload: Dict, usage: Dict):
+        """Count the tokens a completed request spent."""
+        self.metrics.inc("prompt_tokens", usage.get("prompt_tokens", 0))
+        self.metrics.inc("completion_tokens", usage.get("completion_tokens", 0))
+        # Completion lengths show whether max_tokens can be lowered
+        self.metrics.observe(f"completion_tokens_{payload['max_tokens']}", usage.get("completion_tokens", 0))
+        if self.metrics.inc("completions") % METRICS_LOG_EVERY == 0:
+            self._log_metrics()
+    
+    def _opener_payload(self, prompt: str, cultural_context: str) -> Dict:
+        """Build the chat payload for a story opening."""
+        enhanced_prompt = self._create_story_prompt(prompt, cultural_context)
+        
+        return {
+            "model": "sonar-pro",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SYSTEM_OPENER
+                },
+                {
+                    "role": "user",
+                    "content": enhanced_prompt
+                }
+            ],
+            "max_tokens": 300,
+            "temperature": 0.7
+        }
+    
+    def _continuation_payload(self, story_history: List[Dict], user_input: str, cultural_context: str) -> Dict:
+        """Build the chat payload for continuing the story."""
+        messages = [
+            {
+                "role": "system",
+                "content": SYSTEM_CONTINUE
+            }
+        ]
+        
+        entries = [entry for entry in story_history if entry["type"] in ("user", "ai")]
+        
+        # The caller usually records the current input before continuing;
+        # it is re-sent below together with the cultural context
+        if entries and entries[-1]["type"] == "user" and entries[-1]["content"] == user_input:
+            entries = entries[:-1]
+        
+        recent = entries[-MAX_RAW_CONTEXT:]
+        if len(entries) > SUMMARIZE_AFTER:
+            older = entries[:-RAW_TURNS]
+            summary, covered = self._story_summary(older)
+            if summary:
+                messages.append({
+                    "role": "system",
+                    "content": f"Story so far: {summary}"
+                })
+                recent = entries[covered:][-MAX_RAW_CONTEXT:]
+        
+        # Build conversation history ensuring proper alternation
+        conversation_history = []
+        for entry in recent:
+            role = "user" if entry["type"] == "user" else "assistant"
+            
+            # The first turn after the system prompt must come from the user
+            if not conversation_history and role == "assistant":
+                continue
+            
+            conversation_history.append({
+                "role": role,
+                "content": entry["content"]
+            })
+        
+        # Add conversation history to messages
+        messages.extend(conversation_history)
+        
+        # Add current user input with cultural context
+        enhanced_input = self._enhance_with_culture(user_input, cultural_context)
+        messages.append({
+            "role": "user",
+            "content": enhanced_input
+        })
+        
+        # Validate message sequence
+        validated_messages = self._validate_message_sequence(messages)
+        
+        return {
+            "model": "sonar-pro",
+            "messages": validated_messages,
+            "max_tokens": 300,
+            "temperature": 0.7
+        }
+    
+    def _story_summary(self, entries: List[Dict]) -> Tuple[str, int]:
+        """Return the freshest cached summary of entries and how many it covers.
+        
+        A summary that does not yet cover every entry is refreshed in the
+        background, so the current turn never waits on the extra call.
+        """
+        summary, covered = "", 0
+        for index in range(len(entries), 0, -1):
+            cached = self._summaries.get(self._entry_key(entries[index - 1]))
+            if cached:
+                summary, covered = cached, index
+                break
+        
+        if covered < len(entries):
+            self._schedule_summary(entries, summary, covered)
+        
+        return summary, covered
+    
+    def _schedule_summary(self, entries: List[Dict], summary: str, covered: int):
+        """Summarize entries on the worker pool unless already in progress."""
+        key = self._entry_key(entries[-1])
+        with self._summaries_lock:
+            if key in self._summaries_pending:
+                return
+            self._summaries_pending.add(key)
+        
+        _EXECUTOR.submit(self._update_summary, list(entries), summary, covered)
+    
+    def _update_summary(self, entries: List[Dict], summary: str, covered: int):
+        """Fold the entries after the previous summary into a new summary."""
+        key = self._entry_key(entries[-1])
+        try:
+            passages = "\n\n".join(entry["content"] for entry in entries[covered:])
+            prompt = f"New story passages:\n\n{passages}"
+            if summary:
+                prompt = f"Summary so far: {summary}\n\n{prompt}"
+            
             payload = {
                 "model": "sonar-pro",
                 "messages": [
                     {
                         "role": "system",
-                        "content": "You are a creative storyteller generating branching narrative options. Provide exactly 3 distinct, engaging choices."
+                        "content": SYSTEM_SUMMARY
                     },
                     {
                         "role": "user",
                         "content": prompt
                     }
                 ],
-                "max_tokens": 200,
-                "temperature": 0.8
+                "max_tokens": 120,
+                "temperature": 0.2
             }
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                options = self._parse_options(content)
-                return {
-                    "success": True,
-                    "options": options,
-                    "usage": data.get("usage", {})
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"API Error: {response.status_code} - {response.text}"
-                }
-                
-        except Exception as e:
-            return {
-                "success": False,
-                "error": f"Request failed: {str(e)}"
-            }
+            result = self._post_chat(payload)
+            if result["success"]:
+                self._summaries.set(key, result["content"])
+        except Exception:
+            pass  # The next turn falls back to raw history and retries
+        finally:
+            with self._summaries_lock:
+                self._summaries_pending.discard(key)
+    
+    def _entry_key(self, entry: Dict) -> str:
+        """Identify a history entry, preferring its session-assigned id."""
+        return entry.get("id") or entry["content"]
     
     def _create_story_prompt(self, user_prompt: str, cultural_context: str) -> str:
         """Create enhanced prompt with cultural context."""
-        base_prompt = f"Create an engaging story opening based on: {user_prompt}"
-        
-        if cultural_context:
-            base_prompt += f"\n\nIncorporate these cultural elements naturally: {cultural_context}"
+        if not cultural_context:
+            return f"Create an engaging story opening based on: {user_prompt}"
         
-        return base_prompt
+        return _compose_story_prompt(user_prompt, cultural_context)
     
     def _enhance_with_culture(self, user_input: str, cultural_context: str) -> str:
         """Enhance user input with cultural context."""
-        enhanced = user_input
+        if not cultural_context:
+            return user_input
         
-        if cultural_context:
-            enhanced += f"\n\nConsider incorporating: {cultural_context}"
-        
-        return enhanced
+        return user_input + _culture_suffix(cultural_context)
     
     def _parse_options(self, content: str) -> List[str]:
         """Parse branching options from API response."""
-        options = []
-        lines = content.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith(('Option 1:', 'Option 2:', 'Option 3:')):
-                option_text = line.split(':', 1)[1].strip()
-                options.append(option_text)
+        # The first line for each number wins if the model repeats one
+        by_number = {}
+        for number, option_text in OPTION_RE.findall(content):
+            by_number.setdefault(number, option_text)
         
-        # Fallback if parsing fails
-        if len(options) != 3:
+        if by_number.keys() == {"1", "2", "3"}:
+            options = [by_number["1"], by_number["2"], by_number["3"]]
+        else:
+            # Fallback if parsing fails
             options = [
                 "Continue with the current storyline",
                 "Introduce a plot twist",
@@ -247,11 +520,30 @@ Option 3: [continuation]"""
         for message in messages:
             current_role = message["role"]
             
-            # Skip duplicate consecutive messages of same role
+            # Join consecutive messages with the same role (e.g. two AI
+            # passages around a branching choice) so neither is lost
             if current_role == last_role and current_role in ["user", "assistant"]:
+                previous = validated_messages[-1]
+                validated_messages[-1] = {**previous, "content": f"{previous['content']}\n\n{message['content']}"}
                 continue
                 
             validated_messages.append(message)
             last_role = current_role
             
-        return validated_messages 
\ No newline at end of file
+        return validated_messages 
+
+_INSTANCE: Optional[PerplexityService] = None
+_INSTANCE_LOCK = threading.Lock()
+
+def get_service() -> PerplexityService:
+    """Return the process-wide PerplexityService, creating it on first use.
+    
+    Sharing one instance keeps its pooled connections, summaries
+    and metrics across every Streamlit session instead of rebuilding them.
+    """
+    global _INSTANCE
+    if _INSTANCE is None:
+        with _INSTANCE_LOCK:
+            if _INSTANCE is None:
+                _INSTANCE = PerplexityService()
+    return _INSTANCE
@@ -1,177 +1,483 @@
 import os
+import re
+import logging
+import hashlib
+import threading
+import time
+import orjson
 import requests
-from typing import Dict, List, Optional
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import combinations, islice
+from typing import Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
+from utils.cache import TTLCache
+
+try:
+    import redis
+except ImportError:  # Optional: responses are then cached in process only
+    redis = None
+
+try:
+    import re2
+except ImportError:  # Optional: long inputs then use the stdlib engine
+    re2 = None
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Shared worker pool so per-domain Insights calls overlap instead of
+# running back to back
+_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="qloo")
+
+# Compressed encodings urllib3 can decode here (br only when brotli is installed)
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+# Connection settings are read once at import; every instance shares them
+API_KEY = os.getenv("QLOO_API_KEY")
+BASE_URL = os.getenv("QLOO_BASE_URL", "https://hackathon.api.qloo.com")
+
+# Try different authentication methods
+HEADERS = {
+    "X-API-Key": API_KEY,  # Try X-API-Key header
+    "Content-Type": "application/json",
+    "Accept-Encoding": ACCEPT_ENCODING
+}
+
+# Alternative headers if X-API-Key doesn't work; passed per request
+# on the session, where the None value drops the session's X-API-Key
+HEADERS_ALT = {
+    "X-API-Key": None,
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json",
+    "Accept-Encoding": ACCEPT_ENCODING
+}
+
+# Response cache lifetimes (seconds); Insights tags change over days
+SEARCH_TTL = 60
+RECOMMENDATIONS_TTL = 600
+AFFINITIES_TTL = 3600
+# How long a response is kept in all; past its endpoint TTL it is only
+# served when the API errors
+STALE_TTL = 7 * 86400
+# (connect, read) seconds per attempt; with the retry budget below, one
+# Insights GET gives up in under a minute
+REQUEST_TIMEOUT = (5, 10)
+# Fewer entities than this rarely yield useful affinities; skip the call
+MIN_ENTITIES = 2
+# How long an entity set whose affinities were all generic is not re-queried
+LOW_SIGNAL_TTL = 600
+
+# Qloo entity type for each story domain, and the tag types that belong to it
+DOMAIN_TO_ENTITY_TYPE = {
+    "music": "urn:entity:music",
+    "film": "urn:entity:movie",
+    "television": "urn:entity:tv_show",
+    "books": "urn:entity:book",
+    "travel": "urn:entity:place",
+    "brands": "urn:entity:brand"
+}
+DOMAIN_TO_TYPES = {
+    "music": ("urn:entity:music",),
+    "film": ("urn:entity:movie", "urn:entity:tv_show"),
+    "television": ("urn:entity:tv_show",),
+    "books": ("urn:entity:book",),
+    "travel": ("urn:entity:place",),
+    "brands": ("urn:entity:brand",)
+}
+# One pattern per domain matching any of its tag types
+_DOMAIN_TYPE_RE = {
+    domain: re.compile("|".join(map(re.escape, types)))
+    for domain, types in DOMAIN_TO_TYPES.items()
+}
+
+# Insights tags that carry no useful cultural signal for a story
+_GENERIC_TAGS = frozenset({
+    "coin toss", "hair pulling", "experiment", "timeline",
+    "truth or dare", "twerking", "announcement", "thrown out",
+    "self absorption", "coral reef", "unwed pregnancy"
+})
+# Substrings that mark an affinity item as generic (matched with "in")
+_GENERIC_PATTERNS = (
+    "u.s.", "coast guard", "shanghai", "key west", "florida",
+    *sorted(_GENERIC_TAGS)
+)
+
+# Items kept per domain when grouping Insights tags
+MAX_PER_DOMAIN = 3
+# Cultural themes used when no Insights tag maps to a domain
+_DEFAULT_AFFINITIES = {
+    "film": ("Cinematic storytelling", "Visual narrative", "Dramatic tension"),
+    "music": ("Rhythmic elements", "Melodic themes", "Cultural soundscape"),
+    "books": ("Literary depth", "Character development", "Narrative structure"),
+    "travel": ("Cultural exploration", "Geographic diversity", "Urban landscapes"),
+    "brands": ("Lifestyle integration", "Cultural identity", "Modern aesthetics")
+}
+
+# Tag type substring -> story domain used when grouping Insights tags
+_TYPE_RE = re.compile(r"(movie|tv_show|music|book|place|brand)")
+_TYPE_TO_DOMAIN = {
+    "movie": "film",
+    "tv_show": "film",
+    "music": "music",
+    "book": "books",
+    "place": "travel",
+    "brand": "brands"
+}
+_TAG_DOMAINS = frozenset(_TYPE_TO_DOMAIN.values())
+
+# Entity extraction patterns: quoted items and capitalized phrases
+_QUOTED_RE = re.compile(r'"([^"]*)"')
+_CAP_RE = re.compile(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b')
+
+# Common cultural keywords
+CULTURAL_KEYWORDS = frozenset([
+    'jazz', 'rock', 'classical', 'hip-hop', 'electronic', 'folk',
+    'sci-fi', 'fantasy', 'thriller', 'romance', 'comedy', 'drama',
+    'travel', 'adventure', 'mystery', 'historical', 'contemporary',
+    'urban', 'rural', 'futuristic', 'vintage', 'modern'
+])
+STOPWORDS = frozenset({'the', 'and', 'with', 'for'})
+# All keywords in one alternation so the text is scanned once, not per keyword
+_KEYWORD_RE = re.compile(
+    r'\b(' + '|'.join(map(re.escape, sorted(CULTURAL_KEYWORDS))) + r')\b',
+    re.IGNORECASE
+)
+
+# Inputs longer than this use RE2, whose matching time is linear in the input
+LONG_TEXT = 2000
+if re2 is not None:
+    _CAP_RE_LONG = re2.compile(_CAP_RE.pattern)
+    _KEYWORD_RE_LONG = re2.compile('(?i)' + _KEYWORD_RE.pattern)
+else:
+    _CAP_RE_LONG, _KEYWORD_RE_LONG = _CAP_RE, _KEYWORD_RE
+
+class _CappedRetry(Retry):
+    """Retry whose waits, including ones requested by Retry-After, stay short."""
+    
+    MAX_BACKOFF = 4
+    
+    def get_retry_after(self, response) -> Optional[float]:
+        # A long Retry-After would stall the Streamlit worker that is waiting
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(self.MAX_BACKOFF, retry_after)
+
+def _json(response: requests.Response):
+    """Decode a response body with orjson, skipping the text-decode step."""
+    return orjson.loads(response.content)
+
+@lru_cache(maxsize=1024)
+def _extract_entities(text: str) -> Tuple[str, ...]:
+    """Extract entities from text; memoized since prompts recur across turns."""
+    # Simple entity extraction - can be enhanced with NLP
+    # Look for quoted items, capitalized words, and common cultural references
+    entities = []
+    if len(text) > LONG_TEXT:
+        cap_re, keyword_re = _CAP_RE_LONG, _KEYWORD_RE_LONG
+    else:
+        cap_re, keyword_re = _CAP_RE, _KEYWORD_RE
+    
+    # Find quoted items
+    entities.extend(_QUOTED_RE.findall(text))
+    
+    # Find capitalized phrases (potential proper nouns)
+    entities.extend(cap_re.findall(text))
+    
+    entities.extend(match.lower() for match in keyword_re.findall(text))
+    
+    # Remove duplicates (keeping first-seen order) and filter short/common words
+    seen = set()
+    unique = []
+    for entity in entities:
+        key = entity.lower()
+        if len(entity) > 2 and key not in STOPWORDS and key not in seen:
+            seen.add(key)
+            unique.append(entity)
+            if len(unique) == 10:  # Limit to top 10 entities
+                break
+    
+    return tuple(unique)
+
 class QlooService:
     def __init__(self):
-        self.api_key = os.getenv("QLOO_API_KEY")
-        self.base_url = os.getenv("QLOO_BASE_URL", "https://hackathon.api.qloo.com")
+        self.api_key = API_KEY
+        self.base_url = BASE_URL
         
         # Debug: Check if API key is loaded
         if not self.api_key:
-            print("WARNING: QLOO_API_KEY not found in environment variables")
-        
-        # Try different authentication methods
-        self.headers = {
-            "X-API-Key": self.api_key,  # Try X-API-Key header
-            "Content-Type": "application/json"
-        }
-        
-        # Alternative headers if X-API-Key doesn't work
-        self.headers_alt = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+            logger.warning("QLOO_API_KEY not found in environment variables")
+        
+        self.headers = HEADERS
+        self.headers_alt = HEADERS_ALT
+        
+        # Debug: Log header setup for troubleshooting, never the key itself
+        logger.debug("Qloo headers configured (key len=%d)", len(self.api_key or ""))
+        
+        # Persistent session so repeated Insights calls reuse pooled
+        # keep-alive connections instead of a fresh TLS handshake each time
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        retry = _CappedRetry(
+            total=2,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry)
+        self.session.mount("https://", adapter)
+        
+        # Shared Redis cache when REDIS_URL is configured, otherwise per process
+        self.cache = None
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url and redis is not None:
+            self.cache = redis.Redis.from_url(redis_url)
+        self._local_cache = TTLCache(maxsize=2048, ttl=AFFINITIES_TTL)
+        # Entity sets that recently produced nothing relevant
+        self._low_signal = TTLCache(maxsize=512, ttl=LOW_SIGNAL_TTL)
+        
+        # Which auth header the API accepts is probed once, on first use
+        self._auth_resolved = False
+        self._auth_lock = threading.Lock()
+        
+        # Identical requests already on the wire, so concurrent callers share one
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+    
+    def _cached_get(self, endpoint: str, params: Dict, ttl: int) -> Dict:
+        """GET a Qloo endpoint through the response cache.
+        
+        Returns ``{"status_code", "data"}`` for a usable response and
+        ``{"status_code", "text"}`` otherwise. When the API errors, the last
+        good response for the same request is served instead if one exists.
+        Every caller gets its own copy of ``data``.
+        """
+        # One canonical parameter order for both the cache key and the request
+        params_items = sorted(params.items())
+        key = "qloo:" + hashlib.blake2b(
+            f"{endpoint}?{urlencode(params_items)}".encode(),
+            digest_size=16
+        ).hexdigest()
+        
+        entry = self._cache_read(key)
+        if entry is not None and entry["fresh_until"] > time.time():
+            return {"status_code": 200, "data": entry["data"]}
+        
+        with self._inflight_lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                future = self._inflight[key] = Future()
+        if pending is not None:
+            result = pending.result()
+            if "data" not in result:
+                return result
+            # The fetching caller holds the original; waiters get copies
+            return {**result, "data": orjson.loads(orjson.dumps(result["data"]))}
         
-        # Debug: Print headers for troubleshooting
-        print(f"Qloo API Headers: {self.headers}")
+        try:
+            result = self._fetch(endpoint, params_items, key, ttl, entry)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
     
-    def get_affinities(self, entities: List[str], domains: List[str] = None) -> Dict:
-        """Get cultural affinities using Qloo Insights API with Taste Analysis."""
+    def _fetch(self, endpoint: str, params_items: List[Tuple], key: str, ttl: int,
+               stale: Optional[Dict] = None) -> Dict:
+        """Issue the GET behind ``_cached_get`` and update the cache.
+        
+        ``stale`` is the expired cache entry for the request, if any; it is
+        served when the API errors or cannot be reached.
+        """
         try:
-            if not entities:
-                return {"success": False, "error": "No entities provided"}
-            
-            # Use the correct Insights API endpoint
-            endpoint = f"{self.base_url}/v2/insights"
-            
-            # Build query parameters according to Insights API with Taste Analysis
-            params = {
-                "filter.type": "urn:tag"
-            }
-            
-            # Add entity types based on domains
-            entity_types = []
-            if domains:
-                for domain in domains:
-                    if domain == "music":
-                        entity_types.append("urn:entity:music")
-                    elif domain == "film":
-                        entity_types.append("urn:entity:movie")
-                    elif domain == "television":
-                        entity_types.append("urn:entity:tv_show")
-                    elif domain == "books":
-                        entity_types.append("urn:entity:book")
-                    elif domain == "travel":
-                        entity_types.append("urn:entity:place")
-                    elif domain == "brands":
-                        entity_types.append("urn:entity:brand")
-            
-            if entity_types:
-                params["filter.parents.types"] = ",".join(entity_types)
-            
-            # Try to use entities directly as signal.interests.tags instead of entities
-            if entities:
-                # Use tags instead of entities for better compatibility
-                params["signal.interests.tags"] = ",".join(entities[:5])  # Limit to 5 entities
-            
-            # Try with X-API-Key header (primary method)
-            response = requests.get(
+            self._ensure_auth()
+            response = self.session.get(
                 endpoint,
-                headers=self.headers,
-                params=params,
-                timeout=30
+                params=params_items,
+                timeout=REQUEST_TIMEOUT
             )
+        except requests.RequestException:
+            if stale is None:
+                raise
+            return {"status_code": 200, "data": stale["data"], "stale": True}
+        
+        if response.status_code == 200:
+            data = _json(response)
+            self._cache_write(key, data, ttl)
+            return {"status_code": 200, "data": data}
+        
+        if stale is not None:
+            return {"status_code": 200, "data": stale["data"], "stale": True}
+        
+        return {"status_code": response.status_code, "text": response.text}
+    
+    def _ensure_auth(self):
+        """Settle on the auth header the API accepts, probing until it succeeds.
+        
+        X-API-Key is the primary method; if a cheap probe is rejected with
+        401 and the Bearer header is accepted, the session switches to it.
+        The choice is only settled by a successful probe, so a rate limit or
+        outage on the first call leaves the next one to probe again.
+        """
+        if self._auth_resolved:
+            return
+        
+        with self._auth_lock:
+            if self._auth_resolved:
+                return
             
-            # If 401, try with Authorization header
-            if response.status_code == 401:
-                response = requests.get(
-                    endpoint,
-                    headers=self.headers_alt,
-                    params=params,
-                    timeout=30
-                )
+            probe = f"{self.base_url}/v2/insights"
+            params = {"filter.type": "urn:tag", "take": 1}
             
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "success": True,
-                    "affinities": self._process_taste_analysis(data),
-                    "raw_data": data
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"API Error: {response.status_code} - {response.text}"
-                }
-                
-        except Exception as e:
+            response = self.session.get(probe, params=params, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 401:
+                response = self.session.get(probe, headers=self.headers_alt, params=params, timeout=REQUEST_TIMEOUT)
+                if response.status_code // 100 != 2:
+                    return
+                self.session.headers.pop("X-API-Key", None)
+                self.session.headers["Authorization"] = self.headers_alt["Authorization"]
+            elif response.status_code // 100 != 2:
+                return
+            
+            self._auth_resolved = True
+    
+    def _cache_read(self, key: str) -> Optional[Dict]:
+        """Return the cache entry ``{"fresh_until", "data"}`` for key, or None.
+        
+        Entries are kept as encoded bytes, so each read decodes a new copy.
+        """
+        cached = None
+        if self.cache is not None:
+            try:
+                cached = self.cache.get(key)
+            except redis.RedisError:
+                pass  # Cache is best effort; fall through to the local copy
+        
+        if cached is None:
+            cached = self._local_cache.get(key)
+        return orjson.loads(cached) if cached is not None else None
+    
+    def _cache_write(self, key: str, data: Dict, ttl: int):
+        """Store a response under key, fresh for ttl seconds and kept for STALE_TTL."""
+        # Wall-clock expiry, since Redis entries are shared between processes
+        entry = orjson.dumps({"fresh_until": time.time() + ttl, "data": data})
+        if self.cache is not None:
+            try:
+                self.cache.setex(key, STALE_TTL, entry)
+                return
+            except redis.RedisError:
+                pass
+        
+        self._local_cache.set(key, entry, ttl=STALE_TTL)
+    
+    def get_affinities(self, entities: List[str], domains: Tuple[str, ...] = (), include_raw: bool = False) -> Dict:
+        """Get cultural affinities using Qloo Insights API with Taste Analysis."""
+        if not entities:
+            return {"success": False, "error": "No entities provided"}
+        
+        # Use the correct Insights API endpoint
+        endpoint = f"{self.base_url}/v2/insights"
+        
+        # Build query parameters according to Insights API with Taste Analysis
+        params = {
+            "filter.type": "urn:tag"
+        }
+        
+        # Add entity types based on domains
+        entity_types = [DOMAIN_TO_ENTITY_TYPE[d] for d in domains if d in DOMAIN_TO_ENTITY_TYPE]
+        
+        if entity_types:
+            params["filter.parents.types"] = ",".join(sorted(entity_types))
+        
+        # Try to use entities directly as signal.interests.tags instead of entities
+        if entities:
+            # Use tags instead of entities for better compatibility
+            params["signal.interests.tags"] = ",".join(sorted(entities[:5]))  # Limit to 5 entities
+        
+        try:
+            response = self._cached_get(endpoint, params, AFFINITIES_TTL)
+        except (requests.RequestException, ValueError) as e:
+            # Network failures and undecodable bodies; nothing else is expected here
             return {
                 "success": False,
                 "error": f"Request failed: {str(e)}"
             }
+        
+        if response["status_code"] == 200:
+            data = response["data"]
+            result = {
+                "success": True,
+                "affinities": self._process_taste_analysis(data)
+            }
+            # The raw payload is far larger than the processed one; opt in
+            if include_raw:
+                result["raw_data"] = data
+            return result
+        else:
+            return {
+                "success": False,
+                "error": f"API Error: {response['status_code']} - {response['text']}"
+            }
     
-    def get_recommendations(self, seed_entities: List[str], target_domain: str, limit: int = 5) -> Dict:
+    def get_recommendations(self, seed_entities: List[str], target_domain: str, limit: int = 5, include_raw: bool = False) -> Dict:
         """Get recommendations using Qloo Insights API with Taste Analysis."""
+        if not seed_entities:
+            return {"success": False, "error": "No seed entities provided"}
+        
+        # Use the correct Insights API endpoint
+        endpoint = f"{self.base_url}/v2/insights"
+        
+        # Build query parameters for recommendations
+        params = {
+            "filter.type": "urn:tag"
+        }
+        
+        # Map target domain to entity type
+        entity_type = DOMAIN_TO_ENTITY_TYPE.get(target_domain)
+        if entity_type:
+            params["filter.parents.types"] = entity_type
+        
+        # Add signal entities from seed
+        if seed_entities:
+            params["signal.interests.entities"] = ",".join(sorted(seed_entities[:3]))  # Limit to 3 entities
+        
         try:
-            if not seed_entities:
-                return {"success": False, "error": "No seed entities provided"}
-            
-            # Use the correct Insights API endpoint
-            endpoint = f"{self.base_url}/v2/insights"
-            
-            # Build query parameters for recommendations
-            params = {
-                "filter.type": "urn:tag"
+            response = self._cached_get(endpoint, params, RECOMMENDATIONS_TTL)
+        except (requests.RequestException, ValueError) as e:
+            return {
+                "success": False,
+                "error": f"Request failed: {str(e)}"
             }
-            
-            # Map target domain to entity type
-            domain_mapping = {
-                "music": "urn:entity:music",
-                "film": "urn:entity:movie",
-                "television": "urn:entity:tv_show",
-                "books": "urn:entity:book",
-                "travel": "urn:entity:place",
-                "brands": "urn:entity:brand"
+        
+        if response["status_code"] == 200:
+            data = response["data"]
+            result = {
+                "success": True,
+                "recommendations": self._process_taste_analysis_recommendations(data, target_domain)
             }
-            
-            if target_domain in domain_mapping:
-                params["filter.parents.types"] = domain_mapping[target_domain]
-            
-            # Add signal entities from seed
-            if seed_entities:
-                params["signal.interests.entities"] = ",".join(seed_entities[:3])  # Limit to 3 entities
-            
-            # Try with X-API-Key header (primary method)
-            response = requests.get(
-                endpoint,
-                headers=self.headers,
-                params=params,
-                timeout=30
-            )
-            
-            # If 401, try with Authorization header
-            if response.status_code == 401:
-                response = requests.get(
-                    endpoint,
-                    headers=self.headers_alt,
-                    params=params,
-                    timeout=30
-                )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "success": True,
-                    "recommendations": self._process_taste_analysis_recommendations(data, target_domain),
-                    "raw_data": data
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"API Error: {response.status_code} - {response.text}"
-                }
-                
-        except Exception as e:
+            if include_raw:
+                result["raw_data"] = data
+            return result
+        else:
             return {
                 "success": False,
-                "error": f"Request failed: {str(e)}"
+                "error": f"API Error: {response['status_code']} - {response['text']}"
             }
     
-    def _get_affinities_fallback(self, entities: List[str], domains: List[str] = None) -> Dict:
+    def submit(self, method: Callable, *args, **kwargs) -> Future:
+        """Run a service method on the shared worker pool and return its Future."""
+        return _EXECUTOR.submit(method, *args, **kwargs)
+    
+    def _get_affinities_fallback(self, entities: List[str], domains: Tuple[str, ...] = ()) -> Dict:
         """Fallback method when entity search fails."""
         try:
             # Create basic affinities from entities without API call
@@ -187,7 +493,8 @@ class QlooService:
                 "source": "fallback"
             }
             
-        except Exception as e:
+        except TypeError as e:
+            # Entities or domains that are not sequences
             return {
                 "success": False,
                 "error": f"Fallback failed: {str(e)}"
@@ -195,85 +502,40 @@ class QlooService:
     
     def extract_entities_from_text(self, text: str) -> List[str]:
         """Extract potential entities from user text for Qloo processing."""
-        # Simple entity extraction - can be enhanced with NLP
-        import re
-        
-        # Look for quoted items, capitalized words, and common cultural references
-        entities = []
-        
-        # Find quoted items
-        quoted = re.findall(r'"([^"]*)"', text)
-        entities.extend(quoted)
-        
-        # Find capitalized phrases (potential proper nouns)
-        capitalized = re.findall(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b', text)
-        entities.extend(capitalized)
-        
-        # Common cultural keywords
-        cultural_keywords = [
-            'jazz', 'rock', 'classical', 'hip-hop', 'electronic', 'folk',
-            'sci-fi', 'fantasy', 'thriller', 'romance', 'comedy', 'drama',
-            'travel', 'adventure', 'mystery', 'historical', 'contemporary',
-            'urban', 'rural', 'futuristic', 'vintage', 'modern'
-        ]
-        
-        text_lower = text.lower()
-        for keyword in cultural_keywords:
-            if keyword in text_lower:
-                entities.append(keyword)
-        
-        # Remove duplicates and filter short/common words
-        entities = list(set([e for e in entities if len(e) > 2 and e.lower() not in ['the', 'and', 'with', 'for']]))
-        
-        return entities[:10]  # Limit to top 10 entities
+        return list(_extract_entities(text))
     
     def search_entities(self, query: str, entity_type: str = None) -> List[str]:
         """Search for entities using Qloo Entity Search API."""
+        endpoint = f"{self.base_url}/entity_search"
+        
+        params = {
+            "q": query,
+            "limit": 5
+        }
+        
+        if entity_type:
+            params["type"] = entity_type
+        
         try:
-            endpoint = f"{self.base_url}/entity_search"
-            
-            params = {
-                "q": query,
-                "limit": 5
-            }
-            
-            if entity_type:
-                params["type"] = entity_type
-            
-            # Try with X-API-Key header
-            response = requests.get(
-                endpoint,
-                headers=self.headers,
-                params=params,
-                timeout=30
-            )
+            response = self._cached_get(endpoint, params, SEARCH_TTL)
+        except (requests.RequestException, ValueError) as e:
+            # Network failures and undecodable bodies; nothing else is expected here
+            logger.exception("Entity search exception: %s", e)
+            return []
+        
+        if response["status_code"] == 200:
+            data = response["data"]
+            entities = []
             
-            # If 401, try with Authorization header
-            if response.status_code == 401:
-                response = requests.get(
-                    endpoint,
-                    headers=self.headers_alt,
-                    params=params,
-                    timeout=30
-                )
+            if "results" in data and "entities" in data["results"]:
+                for entity in data["results"]["entities"]:
+                    entity_id = entity.get("entity_id", "")
+                    if entity_id:
+                        entities.append(entity_id)
             
-            if response.status_code == 200:
-                data = response.json()
-                entities = []
-                
-                if "results" in data and "entities" in data["results"]:
-                    for entity in data["results"]["entities"]:
-                        entity_id = entity.get("entity_id", "")
-                        if entity_id:
-                            entities.append(entity_id)
-                
-                return entities
-            else:
-                print(f"Entity search failed: {response.status_code} - {response.text}")
-                return []
-                
-        except Exception as e:
-            print(f"Entity search exception: {e}")
+            return entities
+        else:
+            logger.warning("Entity search failed: %s - %s", response["status_code"], response["text"])
             return []
     
     def create_cultural_context(self, user_input: str) -> str:
@@ -283,31 +545,33 @@ class QlooService:
         if not entities:
             return ""
         
+        # Too little signal for a useful Qloo query: use the local mapping
+        key = tuple(entities)
+        if len(entities) < MIN_ENTITIES or self._low_signal.get(key):
+            return self._create_context_from_entities(entities)
+        
         # Try to get affinities from the entities
         affinities_result = self.get_affinities(entities)
         
-        # If Qloo API fails or returns generic results, create context from user input
-        if not affinities_result["success"] or self._is_all_generic(affinities_result["affinities"], entities):
+        # If Qloo API fails, create context from user input
+        if not affinities_result["success"]:
             return self._create_context_from_entities(entities)
         
         cultural_elements = []
         affinities = affinities_result["affinities"]
         
-        # Only include relevant results, not generic ones
+        # Only include relevant results, not generic ones; domains already
+        # hold at most MAX_PER_DOMAIN items, so one filtering pass suffices
         for domain, items in affinities.items():
-            if items:
-                # Filter out generic/irrelevant items
-                relevant_items = []
-                for item in items[:3]:
-                    # Skip items that are too generic or don't match user input
-                    if not self._is_generic_item(item, entities):
-                        relevant_items.append(item)
-                
-                if relevant_items:
-                    cultural_elements.append(f"{domain}: {', '.join(relevant_items)}")
+            # Skip items that are too generic or don't match user input
+            relevant_items = [item for item in items if not self._is_generic_item(item, entities)]
+            
+            if relevant_items:
+                cultural_elements.append(f"{domain}: {', '.join(relevant_items)}")
         
-        # If no relevant results from API, create from user entities
+        # If all results were generic or irrelevant, create from user entities
         if not cultural_elements:
+            self._low_signal.set(key, True)
             return self._create_context_from_entities(entities)
         
         return "; ".join(cultural_elements)
@@ -359,31 +623,12 @@ class QlooService:
             # Generic cultural context based on entities
             return f"cultural: {', '.join(entities[:3])} influences"
     
-    def _is_all_generic(self, affinities: Dict, user_entities: List[str]) -> bool:
-        """Check if all affinity results are generic."""
-        if not affinities:
-            return True
-        
-        for domain, items in affinities.items():
-            for item in items:
-                if not self._is_generic_item(item, user_entities):
-                    return False  # Found at least one relevant item
-        
-        return True  # All items are generic
-    
     def _is_generic_item(self, item: str, user_entities: List[str]) -> bool:
         """Check if an item is too generic or irrelevant to user input."""
-        generic_patterns = [
-            "u.s.", "coast guard", "shanghai", "key west", "florida",
-            "coin toss", "hair pulling", "experiment", "timeline",
-            "truth or dare", "twerking", "announcement", "thrown out",
-            "self absorption", "coral reef", "unwed pregnancy"
-        ]
-        
         item_lower = item.lower()
         
         # Check if item matches any generic pattern
-        for pattern in generic_patterns:
+        for pattern in _GENERIC_PATTERNS:
             if pattern in item_lower:
                 return True
         
@@ -396,93 +641,54 @@ class QlooService:
         # If no relevance found, consider it generic
         return True
     
-    def _process_affinities(self, raw_data: Dict) -> Dict:
-        """Process raw affinity data into organized format."""
-        processed = {}
-        
-        if "affinities" in raw_data:
-            for affinity in raw_data["affinities"]:
-                domain = affinity.get("domain", "unknown")
-                name = affinity.get("name", "")
-                
-                if domain not in processed:
-                    processed[domain] = []
-                
-                if name:
-                    processed[domain].append(name)
-        
-        return processed
-    
     def _process_taste_analysis(self, raw_data: Dict) -> Dict:
         """Process Insights API response with Taste Analysis into organized format."""
         try:
+            # Handle Insights API response format with Taste Analysis
+            if "results" not in raw_data or "tags" not in raw_data["results"]:
+                return {}
+            
+            tags = raw_data["results"]["tags"]
             affinities = {}
+            seen = defaultdict(set)
+            full_domains = 0
             
-            # Handle Insights API response format with Taste Analysis
-            if "results" in raw_data and "tags" in raw_data["results"]:
-                tags = raw_data["results"]["tags"]
+            # Group tags by their types and relevance
+            for tag in tags[:15]:  # Look at more tags for better filtering
+                tag_name = tag.get("name", "")
+                tag_types = tag.get("types", [])
                 
-                # Group tags by their types and relevance
-                for tag in tags[:15]:  # Look at more tags for better filtering
-                    tag_name = tag.get("name", "")
-                    tag_types = tag.get("types", [])
-                    
-                    # Skip tags that are too generic or irrelevant
-                    generic_tags = [
-                        "coin toss", "hair pulling", "experiment", "timeline", 
-                        "truth or dare", "twerking", "announcement", "thrown out",
-                        "self absorption", "coral reef", "unwed pregnancy"
-                    ]
-                    
-                    if tag_name.lower() in generic_tags:
+                # Skip tags that are too generic or irrelevant
+                if not tag_name or tag_name.lower() in _GENERIC_TAGS:
+                    continue
+                
+                # Map tag types to domains with better filtering
+                for tag_type in tag_types:
+                    match = _TYPE_RE.search(tag_type)
+                    if not match:
                         continue
                     
-                    # Map tag types to domains with better filtering
-                    for tag_type in tag_types:
-                        if "movie" in tag_type or "tv_show" in tag_type:
-                            if "film" not in affinities:
-                                affinities["film"] = []
-                            if tag_name not in affinities["film"]:
-                                affinities["film"].append(tag_name)
-                        elif "music" in tag_type:
-                            if "music" not in affinities:
-                                affinities["music"] = []
-                            if tag_name not in affinities["music"]:
-                                affinities["music"].append(tag_name)
-                        elif "book" in tag_type:
-                            if "books" not in affinities:
-                                affinities["books"] = []
-                            if tag_name not in affinities["books"]:
-                                affinities["books"].append(tag_name)
-                        elif "place" in tag_type:
-                            if "travel" not in affinities:
-                                affinities["travel"] = []
-                            if tag_name not in affinities["travel"]:
-                                affinities["travel"].append(tag_name)
-                        elif "brand" in tag_type:
-                            if "brands" not in affinities:
-                                affinities["brands"] = []
-                            if tag_name not in affinities["brands"]:
-                                affinities["brands"].append(tag_name)
-                
-                # If no relevant results, add some cultural themes based on common patterns
-                if not affinities:
-                    affinities = {
-                        "film": ["Cinematic storytelling", "Visual narrative", "Dramatic tension"],
-                        "music": ["Rhythmic elements", "Melodic themes", "Cultural soundscape"],
-                        "books": ["Literary depth", "Character development", "Narrative structure"],
-                        "travel": ["Cultural exploration", "Geographic diversity", "Urban landscapes"],
-                        "brands": ["Lifestyle integration", "Cultural identity", "Modern aesthetics"]
-                    }
+                    # Each domain keeps at most MAX_PER_DOMAIN items
+                    domain = _TYPE_TO_DOMAIN[match.group(1)]
+                    names = seen[domain]
+                    if tag_name not in names and len(names) < MAX_PER_DOMAIN:
+                        names.add(tag_name)
+                        affinities.setdefault(domain, []).append(tag_name)
+                        full_domains += len(names) == MAX_PER_DOMAIN
                 
-                # Limit each domain to 3 items
-                for domain in affinities:
-                    affinities[domain] = affinities[domain][:3]
+                # Later tags cannot add anything once every domain is full
+                if full_domains == len(_TAG_DOMAINS):
+                    break
+            
+            # If no relevant results, add some cultural themes based on common patterns
+            if not affinities:
+                return {domain: list(themes) for domain, themes in _DEFAULT_AFFINITIES.items()}
             
             return affinities
             
-        except Exception as e:
-            print(f"Error processing taste analysis: {e}")
+        except (AttributeError, KeyError, TypeError) as e:
+            # An Insights payload that does not have the expected shape
+            logger.exception("Error processing taste analysis: %s", e)
             return {}
     
     def _process_recommendations(self, raw_data: Dict, domain: str) -> List[str]:
@@ -501,42 +707,36 @@ class QlooService:
         """Process Insights API recommendations with Taste Analysis into list of names."""
         try:
             recommendations = []
+            seen = set()
             
             # Handle Insights API response format with Taste Analysis
             if "results" in raw_data and "tags" in raw_data["results"]:
                 tags = raw_data["results"]["tags"]
                 
                 # Map domain to tag types
-                domain_mapping = {
-                    "music": ["urn:entity:music"],
-                    "film": ["urn:entity:movie", "urn:entity:tv_show"],
-                    "television": ["urn:entity:tv_show"],
-                    "books": ["urn:entity:book"],
-                    "travel": ["urn:entity:place"],
-                    "brands": ["urn:entity:brand"]
-                }
-                
-                target_types = domain_mapping.get(domain, [])
+                target_re = _DOMAIN_TYPE_RE.get(domain)
+                if target_re is None:
+                    return []
                 
                 # Filter tags by domain type
                 for tag in tags[:10]:  # Limit to 10 tags
                     tag_name = tag.get("name", "")
-                    tag_types = tag.get("types", [])
+                    if not tag_name or tag_name in seen:
+                        continue
                     
                     # Check if tag belongs to target domain
-                    for tag_type in tag_types:
-                        if any(target_type in tag_type for target_type in target_types):
-                            if tag_name and tag_name not in recommendations:
-                                recommendations.append(tag_name)
-                                break
+                    if any(target_re.search(tag_type) for tag_type in tag.get("types", [])):
+                        seen.add(tag_name)
+                        recommendations.append(tag_name)
                 
                 # Limit to requested number
                 recommendations = recommendations[:5]
             
             return recommendations
             
-        except Exception as e:
-            print(f"Error processing taste analysis recommendations: {e}")
+        except (AttributeError, KeyError, TypeError) as e:
+            # An Insights payload that does not have the expected shape
+            logger.exception("Error processing taste analysis recommendations: %s", e)
             return []
     
     def get_taste_profile_suggestions(self, preferences: Dict) -> Dict:
@@ -575,16 +775,19 @@ class QlooService:
                     }
                 else:
                     # Log the error for debugging
-                    print(f"Qloo API failed: {affinities_result.get('error', 'Unknown error')}")
+                    logger.warning("Qloo API failed: %s", affinities_result.get("error", "Unknown error"))
                     
             except Exception as e:
-                print(f"Qloo API exception: {e}")
+                # Deliberately broad: whatever goes wrong on the Qloo path, the
+                # user still gets the basic profile below
+                logger.exception("Qloo API exception: %s", e)
             
             # Only use fallback if Qloo API completely fails
-            print("Using fallback profile generation")
+            logger.debug("Using fallback profile generation")
             return self._create_basic_profile(preferences, all_entities)
                 
-        except Exception as e:
+        except (AttributeError, TypeError) as e:
+            # Preferences that are not a mapping of strings / string lists
             return {
                 "success": False,
                 "error": f"Profile generation failed: {str(e)}"
@@ -594,20 +797,15 @@ class QlooService:
         """Create story theme suggestions based on affinities."""
         suggestions = []
         
-        domains = list(affinities.keys())
+        get = affinities.get
         
-        # Create cross-domain suggestions
-        if len(domains) >= 2:
-            for i in range(min(3, len(domains) - 1)):
-                domain1 = domains[i]
-                domain2 = domains[i + 1]
-                
-                items1 = affinities.get(domain1, [])
-                items2 = affinities.get(domain2, [])
-                
-                if items1 and items2:
-                    suggestion = f"A story combining {items1[0]} from {domain1} with {items2[0]} from {domain2}"
-                    suggestions.append(suggestion)
+        # Create cross-domain suggestions from every domain pair, stopping after 5
+        for domain1, domain2 in islice(combinations(affinities, 2), 5):
+            items1, items2 = get(domain1), get(domain2)
+            
+            if items1 and items2:
+                suggestion = f"A story combining {items1[0]} from {domain1} with {items2[0]} from {domain2}"
+                suggestions.append(suggestion)
         
         return suggestions[:5]  # Limit to 5 suggestions
     
@@ -640,16 +838,13 @@ class QlooService:
                             suggestions.append(f"Stories incorporating {item} interests")
             
             # Create cross-category suggestions
-            categories = list(preferences.keys())
-            if len(categories) >= 2:
-                for i in range(min(3, len(categories) - 1)):
-                    cat1 = categories[i]
-                    cat2 = categories[i + 1]
-                    items1 = preferences.get(cat1, [])
-                    items2 = preferences.get(cat2, [])
-                    
-                    if items1 and items2:
-                        suggestions.append(f"Stories combining {items1[0]} from {cat1} with {items2[0]} from {cat2}")
+            categories = list(preferences)
+            items = [preferences[category] for category in categories]
+            for i in range(min(3, len(categories) - 1)):
+                items1, items2 = items[i], items[i + 1]
+                
+                if items1 and items2:
+                    suggestions.append(f"Stories combining {items1[0]} from {categories[i]} with {items2[0]} from {categories[i + 1]}")
             
             return {
                 "success": True,
@@ -658,8 +853,25 @@ class QlooService:
                 "fallback": True
             }
             
-        except Exception as e:
+        except (IndexError, KeyError, TypeError) as e:
+            # Preference values that are not sequences of names
             return {
                 "success": False,
                 "error": f"Basic profile creation failed: {str(e)}"
-            } 
\ No newline at end of file
+            } 
+
+_INSTANCE: Optional[QlooService] = None
+_INSTANCE_LOCK = threading.Lock()
+
+def get_qloo_service() -> QlooService:
+    """Return the process-wide QlooService, creating it on first use.
+    
+    The session, its connection pool and the response cache are safe to
+    share between threads once constructed.
+    """
+    global _INSTANCE
+    if _INSTANCE is None:
+        with _INSTANCE_LOCK:
+            if _INSTANCE is None:
+                _INSTANCE = QlooService()
+    return _INSTANCE
@@ -7,21 +7,51 @@ Production-ready application with enhanced security
 import streamlit as st
 import os
 import re
+import random
+import base64
 from dotenv import load_dotenv
 import secrets
 import hashlib
 import time
-from typing import Dict, List, Optional, Any
+import orjson
+from collections import deque
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterator, List, Optional
 
 # Security: Load environment variables securely
 load_dotenv()
 
 # Security: Import services after environment setup
-from api.perplexity_service import PerplexityService
-from api.qloo_service import QlooService
+from api.perplexity_service import PerplexityAPIError, get_service
+from api.qloo_service import get_qloo_service
 from utils.session_manager import SessionManager
 from utils.export_utils import ExportUtils
 
+# Security: Potentially malicious content, compiled once into a single pattern
+_DANGEROUS_RE = re.compile(r"""
+    <script[^>]*>     # Script tags
+  | javascript:       # JavaScript protocol
+  | on\w+\s*=         # Event handlers
+  | data:text/html    # Data URLs
+  | vbscript:         # VBScript
+  | <iframe[^>]*>     # Iframe tags
+""", re.IGNORECASE | re.VERBOSE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_HTML_ESCAPE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;'
+})
+
+def _is_unsafe(text: str) -> bool:
+    """Return True if text contains potentially malicious content."""
+    # Every pattern needs one of '<', ':' or '=', so plain prose skips the regex
+    # entirely; plain substring tests beat even a one-class regex scan here
+    return ('<' in text or ':' in text or '=' in text) and _DANGEROUS_RE.search(text) is not None
+
 # Security: Add security headers and validation
 def add_security_headers():
     """Add security headers to prevent common attacks."""
@@ -47,18 +77,8 @@ def validate_input(text: str, max_length: int = 1000) -> tuple[bool, str]:
         return False, f"Input too long. Maximum {max_length} characters allowed."
     
     # Security: Check for potentially malicious content
-    dangerous_patterns = [
-        r'<script[^>]*>',  # Script tags
-        r'javascript:',     # JavaScript protocol
-        r'on\w+\s*=',      # Event handlers
-        r'data:text/html', # Data URLs
-        r'vbscript:',      # VBScript
-        r'<iframe[^>]*>',  # Iframe tags
-    ]
-    
-    for pattern in dangerous_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            return False, "Input contains potentially unsafe content"
+    if _is_unsafe(text):
+        return False, "Input contains potentially unsafe content"
     
     return True, ""
 
@@ -72,17 +92,28 @@ def sanitize_text(text: str) -> str:
     Returns:
         Sanitized text
     """
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
-    
-    # Escape special characters
-    text = text.replace('&', '&amp;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
-    text = text.replace('"', '&quot;')
-    text = text.replace("'", '&#x27;')
+    # Remove HTML tags (there are none without a '<'), then escape special
+    # characters in a single pass
+    if '<' in text:
+        text = _TAG_RE.sub('', text)
+    return text.translate(_HTML_ESCAPE)
+
+def sanitize_preferences(prefs: str) -> List[str]:
+    """
+    Split a comma-separated preference field into safe, display-ready items.
     
-    return text
+    Args:
+        prefs: Raw preference input
+        
+    Returns:
+        Items that pass validate_input(max_length=50), sanitized
+    """
+    # One split and strip per field; the checks are the prompt path's own
+    return [
+        sanitize_text(pref)
+        for pref in map(str.strip, prefs.split(","))
+        if validate_input(pref, max_length=50)[0]
+    ]
 
 def rate_limit_check(user_id: str, action: str, max_attempts: int = 5, window_seconds: int = 60) -> bool:
     """
@@ -100,24 +131,20 @@ def rate_limit_check(user_id: str, action: str, max_attempts: int = 5, window_se
     if 'rate_limits' not in st.session_state:
         st.session_state.rate_limits = {}
     
-    current_time = time.time()
-    key = f"{user_id}_{action}"
+    current_time = time.monotonic()
+    key = (user_id, action)
     
     if key not in st.session_state.rate_limits:
-        st.session_state.rate_limits[key] = []
+        st.session_state.rate_limits[key] = deque(maxlen=max_attempts)
+    attempts = st.session_state.rate_limits[key]
     
-    # Remove old attempts
-    st.session_state.rate_limits[key] = [
-        attempt_time for attempt_time in st.session_state.rate_limits[key]
-        if current_time - attempt_time < window_seconds
-    ]
-    
-    # Check if limit exceeded
-    if len(st.session_state.rate_limits[key]) >= max_attempts:
+    # Check if limit exceeded: the ring holds the last max_attempts attempts,
+    # so it is enough to ask whether the oldest is still inside the window
+    if len(attempts) == max_attempts and current_time - attempts[0] < window_seconds:
         return False
     
-    # Add current attempt
-    st.session_state.rate_limits[key].append(current_time)
+    # Add current attempt, pushing out the oldest once the ring is full
+    attempts.append(current_time)
     return True
 
 def generate_csrf_token() -> str:
@@ -131,347 +158,46 @@ def validate_csrf_token(token: str) -> bool:
     return token == st.session_state.get('csrf_token', '')
 
 # Security: Enhanced session initialization
+_SECURE_SESSION_DEFAULTS = (
+    ('security_level', lambda: 'high'),
+    ('rate_limits', dict)
+)
+
 def initialize_secure_session():
     """Initialize session with security measures."""
+    # A fresh session needs both a session ID and a CSRF token; draw them together.
+    # reset_session keeps the ID but drops the token, so fill only what is missing
+    state = st.session_state
+    missing_id = 'session_id' not in state
+    missing_token = 'csrf_token' not in state
+    if missing_id or missing_token:
+        raw = secrets.token_bytes(48)
+        if missing_id:
+            state.session_id = base64.urlsafe_b64encode(raw[:16]).rstrip(b'=').decode()
+        if missing_token:
+            state.csrf_token = base64.urlsafe_b64encode(raw[16:]).rstrip(b'=').decode()
+    
     # Initialize basic session state
     SessionManager.init_session()
     
-    if 'session_id' not in st.session_state:
-        st.session_state.session_id = secrets.token_urlsafe(16)
-    
-    if 'security_level' not in st.session_state:
-        st.session_state.security_level = 'high'
-    
-    # Initialize rate limiting
-    if 'rate_limits' not in st.session_state:
-        st.session_state.rate_limits = {}
+    # Security level and rate limiting; factories give each session its own values
+    for key, factory in _SECURE_SESSION_DEFAULTS:
+        if key not in st.session_state:
+            st.session_state[key] = factory()
+
+# Enhanced Swiss Design CSS styling, read from disk once per process
+_SWISS_CSS = f"<style>\n{(Path(__file__).parent / 'static' / 'swiss.css').read_text()}</style>"
 
-# Enhanced Swiss Design CSS styling
 def apply_swiss_design():
-    st.markdown("""
-    <style>
-    /* Global Styles */
-    .main .block-container {
-        padding-top: 0.3rem;
-        padding-bottom: 0.3rem;
-        max-width: 1200px;
-    }
-    
-    /* Typography */
-    .main-header {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-        font-size: 2.5rem;
-        font-weight: 300;
-        color: #000000;
-        text-align: left;
-        margin-bottom: 0.2rem;
-        line-height: 1.1;
-        letter-spacing: -0.02em;
-    }
-    
-    .tagline {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-        font-size: 1rem;
-        color: #666666;
-        font-weight: 300;
-        margin-bottom: 1.5rem;
-        line-height: 1.4;
-        font-style: italic;
-    }
-    
-    .section-header {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-        font-size: 1.2rem;
-        font-weight: 400;
-        color: #000000;
-        margin-top: 1.2rem;
-        margin-bottom: 0.6rem;
-        border-bottom: 2px solid #000000;
-        padding-bottom: 0.2rem;
-        text-transform: uppercase;
-        letter-spacing: 0.1em;
-    }
-    
-    /* Story Content */
-    .story-content {
-        background-color: #FAFAFA;
-        padding: 0.4rem;
-        border-left: 4px solid #000000;
-        margin: 0.3rem 0;
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-        line-height: 1.6;
-        font-size: 1rem;
-    }
-    
-    .story-content strong {
-        font-weight: 600;
-        color: #000000;
-        text-transform: uppercase;
-        font-size: 0.9rem;
-        letter-spacing: 0.05em;
-    }
-    
-    /* Cultural Insights */
-    .cultural-insight {
-        background-color: #F8F8F8;
-        padding: 0.3rem;
-        border: 1px solid #E0E0E0;
-        margin: 0.2rem 0;
-        font-size: 0.9rem;
-        color: #555555;
-        line-height: 1.5;
-        border-radius: 0;
-    }
-    
-    .cultural-insight strong {
-        color: #000000;
-        font-weight: 500;
-    }
-    
-    /* Interface Elements */
-    .turn-counter {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-        font-size: 0.8rem;
-        color: #888888;
-        text-align: right;
-        margin-bottom: 0.2rem;
-    }
-    
-    /* Button Styling - Consistent Swiss Design */
-    .stButton > button {
-        background-color: #000000 !important;
-        color: #FFFFFF !important;
-        border: 2px solid #000000 !important;
-        border-radius: 0 !important;
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif !important;
-        font-weight: 400 !important;
-        font-size: 0.9rem !important;
-        text-transform: uppercase !important;
-        letter-spacing: 0.1em !important;
-        padding: 0.3rem 0.8rem !important;
-        transition: all 0.2s ease !important;
-        box-shadow: none !important;
-        min-height: 44px !important;
-    }
-    
-    .stButton > button:hover {
-        background-color: #FFFFFF !important;
-        color: #000000 !important;
-        border-color: #000000 !important;
-        transform: translateY(-1px) !important;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1) !important;
-    }
-    
-    .stButton > button:disabled {
-        background-color: #000000 !important;
-        color: #FFFFFF !important;
-        border-color: #000000 !important;
-        cursor: not-allowed !important;
-        transform: none !important;
-        box-shadow: none !important;
-    }
-    
-    .stButton > button:active {
-        transform: translateY(0) !important;
-        box-shadow: 0 1px 2px rgba(0,0,0,0.1) !important;
-    }
-    
-    /* Text Input Styling */
-    .stTextArea textarea, .stTextInput input {
-        border: 2px solid #E0E0E0 !important;
-        border-radius: 0 !important;
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif !important;
-        font-size: 0.9rem !important;
-        padding: 0.3rem !important;
-        background-color: #FFFFFF !important;
-        transition: border-color 0.2s ease !important;
-    }
-    
-    .stTextArea textarea:focus, .stTextInput input:focus {
-        border-color: #000000 !important;
-        box-shadow: none !important;
-        outline: none !important;
-    }
-    
-    /* Sidebar Styling - Always Visible */
-    .css-1d391kg {
-        background-color: #F8F8F8 !important;
-        border-right: 2px solid #E0E0E0 !important;
-    }
-    
-    /* Progress Bar Styling */
-    .stProgress > div > div > div > div {
-        background-color: #000000 !important;
-    }
-    
-    /* Metric Styling */
-    .css-1wivap2 {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif !important;
-        font-weight: 400 !important;
-    }
-    
-    /* Form Accessibility */
-    .stTextArea textarea, .stTextInput input {
-        autocomplete: "off";
-    }
-    
-    /* Ensure proper label associations */
-    .stTextArea label, .stTextInput label {
-        display: block;
-        margin-bottom: 0.3rem;
-        font-weight: 500;
-        color: #000000;
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-    }
-    
-    /* Form field IDs and names */
-    .stTextArea textarea, .stTextInput input {
-        id: attr(data-testid);
-        name: attr(data-testid);
-    }
-    
-    /* Autocomplete attributes */
-    .stTextArea textarea[data-testid="story_prompt_input"] {
-        autocomplete: "off";
-    }
-    
-    .stTextInput input[data-testid="music_prefs_input"] {
-        autocomplete: "off";
-    }
-    
-    .stTextInput input[data-testid="film_prefs_input"] {
-        autocomplete: "off";
-    }
-    
-    .stTextInput input[data-testid="book_prefs_input"] {
-        autocomplete: "off";
-    }
-    
-    .stTextInput input[data-testid="travel_prefs_input"] {
-        autocomplete: "off";
-    }
-    
-    .stTextInput input[data-testid="brand_prefs_input"] {
-        autocomplete: "off";
-    }
-    
-    .stTextInput input[data-testid="other_prefs_input"] {
-        autocomplete: "off";
-    }
-    
-    .stTextArea textarea[data-testid="story_continuation_input"] {
-        autocomplete: "off";
-    }
-    
-    /* Footer Styling - Swiss Design */
-    .element-container .stMarkdown {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-    }
-    
-    /* Footer links styling */
-    .element-container .stMarkdown a {
-        color: #000000;
-        text-decoration: none;
-        font-weight: 400;
-        transition: color 0.2s ease;
-    }
-    
-    .element-container .stMarkdown a:hover {
-        color: #666666;
-        text-decoration: underline;
-    }
-    
-    /* Footer captions */
-    .element-container .stCaption {
-        color: #888888;
-        font-size: 0.8rem;
-        font-weight: 300;
-    }
-    
-    /* Footer column spacing - more aggressive */
-    .element-container .row-widget.stHorizontal {
-        gap: 0.1rem !important;
-        margin: 0 !important;
-        padding: 0 !important;
-    }
-    
-    /* Footer content spacing */
-    .element-container .stMarkdown {
-        margin-bottom: 0.05rem !important;
-        margin-top: 0.05rem !important;
-    }
-    
-    /* Footer container spacing */
-    .element-container {
-        margin-bottom: 0.2rem !important;
-    }
-    
-    /* Specific footer column targeting */
-    .element-container .stHorizontal > div {
-        padding: 0 0.2rem !important;
-    }
-    
-    /* Loading States */
-    .loading-container {
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        padding: 2rem;
-        background-color: #FAFAFA;
-        border: 1px solid #E0E0E0;
-        margin: 1rem 0;
-    }
-    
-    .loading-text {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif;
-        font-size: 0.9rem;
-        color: #666666;
-        text-transform: uppercase;
-        letter-spacing: 0.1em;
-    }
-    
-    /* Success/Error Messages */
-    .stAlert {
-        border-radius: 0 !important;
-        border-left: 4px solid !important;
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif !important;
-    }
-    
-    /* Expander Styling */
-    .streamlit-expanderHeader {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif !important;
-        font-weight: 500 !important;
-        text-transform: uppercase !important;
-        letter-spacing: 0.1em !important;
-        color: #000000 !important;
-        border-bottom: 1px solid #E0E0E0 !important;
-    }
-    
-    /* Checkbox Styling */
-    .stCheckbox > label {
-        font-family: 'Helvetica Neue', 'Helvetica', Arial, sans-serif !important;
-        font-size: 0.9rem !important;
-        color: #333333 !important;
-    }
-    
-    /* Hide Streamlit Default Elements */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-    
-    /* Smooth Transitions */
-    * {
-        transition: all 0.2s ease;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    # Streamlit drops elements a rerun does not emit, so the styles go out every run
+    st.markdown(_SWISS_CSS, unsafe_allow_html=True)
 
 def initialize_services():
     """Initialize API services."""
     try:
         if 'perplexity_service' not in st.session_state:
-            st.session_state.perplexity_service = PerplexityService()
-            st.session_state.qloo_service = QlooService()
+            st.session_state.perplexity_service = get_service()
+            st.session_state.qloo_service = get_qloo_service()
             
             # Test API connectivity
             if st.session_state.perplexity_service.api_key:
@@ -508,7 +234,7 @@ def main():
         stats = SessionManager.get_session_stats()
         
         # API Status
-        if hasattr(st.session_state, 'api_status'):
+        if 'api_status' in st.session_state:
             st.info(st.session_state.api_status)
         
         # Progress indicator
@@ -523,10 +249,8 @@ def main():
         
         st.metric("STORY LENGTH", f"{stats['story_length']:,} chars")
         
-        st.markdown("---")
-        
-        # Enhanced action buttons
-        st.markdown("### ACTIONS")
+        # Enhanced action buttons; each separator and its header share one element
+        st.markdown("---\n\n### ACTIONS")
         
         if st.button("NEW STORY", key="new_story_button", use_container_width=True):
             SessionManager.reset_session()
@@ -536,10 +260,8 @@ def main():
             if st.button("EXPORT STORY", key="export_story_button", use_container_width=True):
                 show_export_options()
         
-        st.markdown("---")
-        
         # Demo mode with better styling
-        st.markdown("### DEMO MODE")
+        st.markdown("---\n\n### DEMO MODE")
         demo_enabled = st.checkbox("Enable Demo Examples")
         
         if demo_enabled:
@@ -549,11 +271,9 @@ def main():
             st.session_state.demo_mode = False
             
         if st.session_state.cultural_context:
-            st.markdown("---")
-            st.markdown("### CULTURAL STATUS")
+            st.markdown("---\n\n### CULTURAL STATUS")
             st.success("Cultural enrichment active")
-            context_preview = st.session_state.cultural_context[:100] + "..." if len(st.session_state.cultural_context) > 100 else st.session_state.cultural_context
-            st.caption(context_preview)
+            st.caption(st.session_state.cultural_context_preview)
     
     # Error display
     if st.session_state.last_error:
@@ -566,7 +286,7 @@ def main():
     if not st.session_state.story_started:
         show_story_initiation()
     else:
-        show_story_interface()
+        show_story_interface(stats)
     
     # Add professional footer
     show_footer()
@@ -590,7 +310,7 @@ def show_story_initiation():
         show_taste_profile_builder()
         
         # Show if taste profile is active
-        if hasattr(st.session_state, 'user_preferences') and st.session_state.user_preferences:
+        if 'user_preferences' in st.session_state and st.session_state.user_preferences:
             st.success("Cultural profile active - will enhance your story generation")
             user_prefs = st.session_state.user_preferences
             pref_list = []
@@ -604,11 +324,8 @@ def show_story_initiation():
     st.markdown("### Story Prompt")
     
     # Handle demo prompt if set
-    default_prompt = ""
-    if hasattr(st.session_state, 'demo_prompt'):
-        default_prompt = st.session_state.demo_prompt
-        # Clear the demo prompt after using it
-        del st.session_state.demo_prompt
+    # Clear the demo prompt after using it
+    default_prompt = st.session_state.pop('demo_prompt', "")
     
     story_prompt = st.text_area(
         "Describe the story you want to create:",
@@ -621,6 +338,9 @@ def show_story_initiation():
         label_visibility="visible"
     )
     
+    # The opener streams in at full width, not inside the clicked button's column
+    stream_slot = st.empty()
+    
     # Enhanced action area - buttons side by side
     col1, col2 = st.columns(2)
     
@@ -631,15 +351,16 @@ def show_story_initiation():
                 return
             try:
                 with st.spinner("Creating your story..."):
-                    create_story_opener(story_prompt)
+                    create_story_opener(story_prompt, placeholder=stream_slot)
             except Exception as e:
                 st.error(f"Failed to create story: {str(e)}")
     
     with col2:
+        prefetch_surprise()
         if st.button("SURPRISE ME", key="surprise_me_button", use_container_width=True):
             try:
                 with st.spinner("Generating surprise story..."):
-                    surprise_continuation()
+                    surprise_continuation(stream_slot)
             except Exception as e:
                 st.error(f"Failed to generate surprise: {str(e)}")
     
@@ -659,9 +380,10 @@ def show_story_initiation():
             st.rerun()
     
     # Handle temp prompt
-    if hasattr(st.session_state, 'temp_prompt') and st.session_state.temp_prompt:
-        create_story_opener(st.session_state.temp_prompt)
-        del st.session_state.temp_prompt
+    # Taken out before use: create_story_opener reruns the script on success
+    temp_prompt = st.session_state.pop('temp_prompt', None)
+    if temp_prompt:
+        create_story_opener(temp_prompt)
 
 def show_taste_profile_builder():
     """Display enhanced taste profile builder interface."""
@@ -691,29 +413,15 @@ def show_taste_profile_builder():
             
             with st.spinner("Building your cultural profile..."):
                 # Check if Qloo service is available
-                if not hasattr(st.session_state, 'qloo_service'):
+                if 'qloo_service' not in st.session_state:
                     st.error("Cultural service not available. Please refresh the page.")
                     return
                 
-                # Security: Validate and sanitize preferences
-                def sanitize_preferences(pref_list):
-                    sanitized = []
-                    for pref in pref_list:
-                        # Validate each preference
-                        is_valid, _ = validate_input(pref, max_length=50)
-                        if is_valid:
-                            sanitized.append(sanitize_text(pref.strip()))
-                    return sanitized
-                
-                # Collect and sanitize preferences
-                preferences = {
-                    "music": sanitize_preferences([x.strip() for x in music_prefs.split(",") if x.strip()]) if music_prefs else [],
-                    "film": sanitize_preferences([x.strip() for x in film_prefs.split(",") if x.strip()]) if film_prefs else [],
-                    "books": sanitize_preferences([x.strip() for x in book_prefs.split(",") if x.strip()]) if book_prefs else [],
-                    "travel": sanitize_preferences([x.strip() for x in travel_prefs.split(",") if x.strip()]) if travel_prefs else [],
-                    "brands": sanitize_preferences([x.strip() for x in brand_prefs.split(",") if x.strip()]) if brand_prefs else [],
-                    "other": sanitize_preferences([x.strip() for x in other_prefs.split(",") if x.strip()]) if other_prefs else []
-                }
+                # Security: Collect, validate and sanitize preferences, skipping empty fields
+                preferences = {}
+                for category, prefs in (("music", music_prefs), ("film", film_prefs), ("books", book_prefs),
+                                        ("travel", travel_prefs), ("brands", brand_prefs), ("other", other_prefs)):
+                    preferences[category] = sanitize_preferences(prefs) if prefs else []
                 
                 # Generate profile
                 result = st.session_state.qloo_service.get_taste_profile_suggestions(preferences)
@@ -729,6 +437,8 @@ def show_taste_profile_builder():
                     
                     # Store both preferences and suggestions
                     st.session_state.user_preferences = preferences
+                    # Flattened once here so story generation can reuse it
+                    st.session_state.flat_prefs = [item for items in preferences.values() for item in items]
                     if "suggestions" in result:
                         st.session_state.taste_suggestions = result["suggestions"]
                     
@@ -746,8 +456,60 @@ def show_taste_profile_builder():
             st.error(f"Profile generation failed: {str(e)}")
             st.write("Please check your internet connection and try again.")
 
-def create_story_opener(prompt: str):
-    """Create the initial story using Perplexity and Qloo with security measures."""
+def stream_story_text(stream: Callable[[], Iterator[str]], fallback: Callable[[], Dict],
+                      placeholder=None) -> Dict:
+    """
+    Show generated story text as it streams in, returning the usual result dict.
+    
+    Args:
+        stream: Starts the streaming request and yields text chunks
+        fallback: Non-streaming request used if streaming fails before any text arrives
+        placeholder: st.empty() slot to render into; one is created in the
+            current container if omitted
+        
+    Returns:
+        Result dict with success and content or error; ``truncated`` is set
+        when the stream failed after part of the passage arrived
+    """
+    if placeholder is None:
+        placeholder = st.empty()
+    chunks = []
+    last_render = 0.0
+    truncated = False
+    
+    try:
+        for chunk in stream():
+            chunks.append(chunk)
+            # Redraw at most ten times a second; every redraw resends the whole text
+            now = time.monotonic()
+            if now - last_render >= 0.1:
+                placeholder.markdown("".join(chunks))
+                last_render = now
+    except PerplexityAPIError:
+        if not chunks:
+            # The regular request path turns the failure into an error result
+            placeholder.empty()
+            return fallback()
+        # Part of the passage is already on screen and billed; keep it rather
+        # than paying for a second completion
+        truncated = True
+    
+    content = "".join(chunks)
+    if not content:
+        placeholder.empty()
+        return fallback()
+    
+    placeholder.markdown(content)
+    return {"success": True, "content": content, "truncated": truncated}
+
+# Shown when a streamed passage stops early
+TRUNCATED_WARNING = "The connection dropped before the passage finished. It was kept as is and did not count as a turn."
+
+def create_story_opener(prompt: str, placeholder=None):
+    """Create the initial story using Perplexity and Qloo with security measures.
+    
+    ``placeholder`` is where the opener streams in (see stream_story_text).
+    """
     
     # Security: Input validation
     is_valid, error_msg = validate_input(prompt, max_length=500)
@@ -766,7 +528,7 @@ def create_story_opener(prompt: str):
     
     try:
         # Check if services are initialized
-        if not hasattr(st.session_state, 'qloo_service') or not hasattr(st.session_state, 'perplexity_service'):
+        if 'qloo_service' not in st.session_state or 'perplexity_service' not in st.session_state:
             st.error("Services not initialized. Please refresh the page.")
             return
         
@@ -774,43 +536,29 @@ def create_story_opener(prompt: str):
         cultural_context = ""
         try:
             # First, try to use taste profile if available
-            if hasattr(st.session_state, 'user_preferences') and st.session_state.user_preferences:
-                # Use actual user preferences to enhance the prompt
-                user_prefs = st.session_state.user_preferences
-                pref_list = []
-                for category, items in user_prefs.items():
-                    if items:
-                        pref_list.extend(items[:2])  # Take top 2 from each category
+            all_prefs = st.session_state.get('flat_prefs')
+            if all_prefs:
+                top_prefs = ', '.join(all_prefs[:8])
                 
-                if pref_list:
-                    # Ensure we include preferences from all categories, prioritizing non-empty ones
-                    all_prefs = []
-                    for category, items in user_prefs.items():
-                        if items:
-                            all_prefs.extend(items)
-                    
-                    # Create enhanced prompt with cultural preferences
-                    enhanced_prompt = f"{sanitized_prompt} (Cultural preferences: {', '.join(all_prefs[:8])})"
-                    
-                    # Use the enhanced prompt for cultural context
-                    cultural_context = st.session_state.qloo_service.create_cultural_context(enhanced_prompt)
-                    
-                    # If no relevant cultural context found, create one based on user preferences
-                    if not cultural_context:
-                        cultural_context = _create_cultural_context_from_preferences(all_prefs)
-                    
-                    # Also create cultural context directly from user preferences for better integration
-                    preference_context = _create_cultural_context_from_preferences(all_prefs)
-                    if preference_context:
-                        cultural_context = f"{cultural_context}; {preference_context}" if cultural_context else preference_context
-                    
-                    SessionManager.add_cultural_explanation(
-                        "Taste Profile Integration",
-                        f"Enhanced story with your cultural preferences: {', '.join(all_prefs[:8])}"
-                    )
-                else:
-                    # Fallback to extracting from prompt only
-                    cultural_context = st.session_state.qloo_service.create_cultural_context(sanitized_prompt)
+                # Create enhanced prompt with cultural preferences
+                enhanced_prompt = f"{sanitized_prompt} (Cultural preferences: {top_prefs})"
+                
+                # Use the enhanced prompt for cultural context
+                cultural_context = st.session_state.qloo_service.create_cultural_context(enhanced_prompt)
+                
+                # If no relevant cultural context found, create one based on user preferences
+                if not cultural_context:
+                    cultural_context = _create_cultural_context_from_preferences(all_prefs)
+                
+                # Also create cultural context directly from user preferences for better integration
+                preference_context = _create_cultural_context_from_preferences(all_prefs)
+                if preference_context:
+                    cultural_context = f"{cultural_context}; {preference_context}" if cultural_context else preference_context
+                
+                SessionManager.add_cultural_explanation(
+                    "Taste Profile Integration",
+                    f"Enhanced story with your cultural preferences: {top_prefs}"
+                )
             else:
                 # Fallback to extracting from prompt only
                 cultural_context = st.session_state.qloo_service.create_cultural_context(sanitized_prompt)
@@ -825,7 +573,12 @@ def create_story_opener(prompt: str):
             st.warning(f"Cultural context unavailable: {str(e)}")
         
         # Generate story opener with Perplexity
-        result = st.session_state.perplexity_service.generate_story_opener(sanitized_prompt, cultural_context)
+        service = st.session_state.perplexity_service
+        result = stream_story_text(
+            lambda: service.stream_story_opener(sanitized_prompt, cultural_context),
+            lambda: service.generate_story_opener(sanitized_prompt, cultural_context),
+            placeholder
+        )
         
         if result["success"]:
             # Security: Sanitize AI response before storing
@@ -834,8 +587,12 @@ def create_story_opener(prompt: str):
             # Add entries to story
             SessionManager.add_story_entry(sanitized_prompt, "user")
             SessionManager.add_story_entry(sanitized_content, "ai")
-            SessionManager.increment_turn()
             st.session_state.story_started = True
+            if result.get("truncated"):
+                # Keep the cut-off passage, but it does not use up a turn
+                st.warning(TRUNCATED_WARNING)
+                return
+            SessionManager.increment_turn()
             st.success("Story created successfully!")
             st.rerun()
         else:
@@ -846,46 +603,48 @@ def create_story_opener(prompt: str):
         st.error(f"❌ Unexpected error: {str(e)}")
         st.write("Please check your internet connection and API keys.")
 
+# Map preferences to cultural domains
+CULTURAL_MAPPING = {
+    "japan": "travel: Japanese culture, Zen aesthetics, Traditional craftsmanship",
+    "jazz": "music: Jazz improvisation, Blues influences, Swing rhythms",
+    "sci-fi": "film: Science fiction, Futuristic themes, Technological innovation",
+    "mystery": "books: Detective fiction, Suspense narrative, Crime investigation",
+    "minimalist": "lifestyle: Minimalist design, Clean aesthetics, Functional beauty",
+    "meditation": "lifestyle: Mindfulness practices, Spiritual wellness, Inner peace",
+    "rock": "music: Rock energy, Electric guitars, Powerful rhythms",
+    "classical": "music: Orchestral arrangements, Classical composition, Timeless elegance",
+    "hip-hop": "music: Urban beats, Rap culture, Street art influence",
+    "electronic": "music: Digital soundscapes, Synthesizer textures, Modern production",
+    "fantasy": "books: Magical worlds, Epic quests, Mythical creatures",
+    "thriller": "film: Suspenseful tension, Psychological drama, Intense pacing",
+    "romance": "books: Emotional depth, Love stories, Heartfelt connections",
+    "comedy": "film: Humorous situations, Light-hearted storytelling, Witty dialogue",
+    "drama": "film: Character development, Emotional intensity, Realistic storytelling",
+    "travel": "lifestyle: Cultural exploration, Geographic diversity, Adventure themes",
+    "adventure": "lifestyle: Exploration spirit, Risk-taking, Discovery narratives",
+    "historical": "books: Period settings, Historical accuracy, Time-travel themes",
+    "contemporary": "lifestyle: Modern settings, Current social issues, Present-day relevance",
+    "urban": "lifestyle: City life, Metropolitan culture, Street-level stories",
+    "rural": "lifestyle: Countryside settings, Natural environments, Community focus",
+    "futuristic": "film: Advanced technology, Sci-fi aesthetics, Tomorrow's world",
+    "vintage": "lifestyle: Retro aesthetics, Nostalgic themes, Classic style",
+    "modern": "lifestyle: Contemporary design, Current trends, Present-day relevance"
+}
+# Every key in one pass; the lookahead also reports keys that overlap
+_CULTURAL_KEY_RE = re.compile("(?=(" + "|".join(map(re.escape, CULTURAL_MAPPING)) + "))")
+_CULTURAL_KEY_RANK = {key: rank for rank, key in enumerate(CULTURAL_MAPPING)}
+
 def _create_cultural_context_from_preferences(preferences: List[str]) -> str:
     """Create cultural context from user preferences when Qloo API doesn't return relevant results."""
     if not preferences:
         return ""
     
-    # Map preferences to cultural domains
-    cultural_mapping = {
-        "japan": "travel: Japanese culture, Zen aesthetics, Traditional craftsmanship",
-        "jazz": "music: Jazz improvisation, Blues influences, Swing rhythms",
-        "sci-fi": "film: Science fiction, Futuristic themes, Technological innovation",
-        "mystery": "books: Detective fiction, Suspense narrative, Crime investigation",
-        "minimalist": "lifestyle: Minimalist design, Clean aesthetics, Functional beauty",
-        "meditation": "lifestyle: Mindfulness practices, Spiritual wellness, Inner peace",
-        "rock": "music: Rock energy, Electric guitars, Powerful rhythms",
-        "classical": "music: Orchestral arrangements, Classical composition, Timeless elegance",
-        "hip-hop": "music: Urban beats, Rap culture, Street art influence",
-        "electronic": "music: Digital soundscapes, Synthesizer textures, Modern production",
-        "fantasy": "books: Magical worlds, Epic quests, Mythical creatures",
-        "thriller": "film: Suspenseful tension, Psychological drama, Intense pacing",
-        "romance": "books: Emotional depth, Love stories, Heartfelt connections",
-        "comedy": "film: Humorous situations, Light-hearted storytelling, Witty dialogue",
-        "drama": "film: Character development, Emotional intensity, Realistic storytelling",
-        "travel": "lifestyle: Cultural exploration, Geographic diversity, Adventure themes",
-        "adventure": "lifestyle: Exploration spirit, Risk-taking, Discovery narratives",
-        "historical": "books: Period settings, Historical accuracy, Time-travel themes",
-        "contemporary": "lifestyle: Modern settings, Current social issues, Present-day relevance",
-        "urban": "lifestyle: City life, Metropolitan culture, Street-level stories",
-        "rural": "lifestyle: Countryside settings, Natural environments, Community focus",
-        "futuristic": "film: Advanced technology, Sci-fi aesthetics, Tomorrow's world",
-        "vintage": "lifestyle: Retro aesthetics, Nostalgic themes, Classic style",
-        "modern": "lifestyle: Contemporary design, Current trends, Present-day relevance"
-    }
-    
     relevant_contexts = []
     for pref in preferences[:5]:  # Limit to 5 preferences
-        pref_lower = pref.lower()
-        for key, context in cultural_mapping.items():
-            if key in pref_lower:
-                relevant_contexts.append(context)
-                break
+        keys = _CULTURAL_KEY_RE.findall(pref.lower())
+        if keys:
+            # Same pick as scanning the mapping in order: the earliest listed key
+            relevant_contexts.append(CULTURAL_MAPPING[min(keys, key=_CULTURAL_KEY_RANK.__getitem__)])
     
     if relevant_contexts:
         return "; ".join(relevant_contexts)
@@ -893,11 +652,22 @@ def _create_cultural_context_from_preferences(preferences: List[str]) -> str:
         # Generic cultural context based on preferences
         return f"cultural: {', '.join(preferences[:3])} influences"
 
-def show_story_interface():
-    """Display the enhanced main story interface."""
+# Story entry markup around the content, by entry type
+_ENTRY_OPEN = {
+    'user': '<div class="story-content" style="border-left-color: #666666; background-color: #F5F5F5;">\n'
+            '<strong style="color: #666666">You:</strong><br/>\n',
+    'ai': '<div class="story-content">\n'
+          '<strong style="color: #000000">Narravox AI:</strong><br/>\n'
+}
+_ENTRY_CLOSE = '\n</div>\n'
+
+def _format_story_entry(entry: Dict) -> str:
+    """Render one user or AI story entry as HTML."""
+    return _ENTRY_OPEN[entry['type']] + entry['content'] + _ENTRY_CLOSE
+
+def show_story_interface(stats: Dict):
+    """Display the enhanced main story interface, using the run's session stats from main."""
     # Enhanced turn counter with progress
-    stats = SessionManager.get_session_stats()
-    
     col1, col2, col3 = st.columns([2, 1, 1])
     with col1:
         st.markdown(f'<div class="turn-counter">Turn {stats["turns_completed"]} of {stats["max_turns"]}</div>', unsafe_allow_html=True)
@@ -911,30 +681,33 @@ def show_story_interface():
     # Display current story with enhanced formatting
     st.markdown('<div class="section-header">Narrative Thread</div>', unsafe_allow_html=True)
     
-    # Show story history with alternating styling
-    for i, entry in enumerate(st.session_state.story_history):
+    # Show story history with alternating styling; entries never change once
+    # added, so each one's HTML is built on its first render only
+    rendered = st.session_state.setdefault('rendered_entries', {})
+    parts = []
+    for entry in st.session_state.story_history:
         if entry['type'] in ['user', 'ai']:
-            speaker = "You" if entry['type'] == 'user' else "Narravox AI"
-            speaker_color = "#666666" if entry['type'] == 'user' else "#000000"
-            
-            story_style = "story-content"
-            if entry['type'] == 'user':
-                story_style += '" style="border-left-color: #666666; background-color: #F5F5F5;'
-            
-            st.markdown(f'''
-            <div class="{story_style}">
-                <strong style="color: {speaker_color}">{speaker}:</strong><br/>
-                {entry["content"]}
-            </div>
-            ''', unsafe_allow_html=True)
+            html = rendered.get(entry['id'])
+            if html is None:
+                html = rendered[entry['id']] = _format_story_entry(entry)
+            parts.append(html)
+    
+    # The whole thread goes out as one element instead of one per entry
+    if parts:
+        st.markdown("".join(parts), unsafe_allow_html=True)
+    
+    # New passages stream in below the thread at full width, not inside the
+    # narrow column of the button that was clicked
+    stream_slot = st.empty()
     
     # Enhanced cultural insights panel
     if st.session_state.cultural_explanations:
         with st.expander("CULTURAL INTELLIGENCE INSIGHTS", expanded=True):
             st.markdown("Qloo Insights API has discovered these cultural connections through Taste Analysis:")
-            for key, explanation in st.session_state.cultural_explanations.items():
-                st.markdown(f'<div class="cultural-insight"><strong>{key}:</strong> {explanation}</div>', 
-                           unsafe_allow_html=True)
+            st.markdown("\n".join(
+                f'<div class="cultural-insight"><strong>{key}:</strong> {explanation}</div>'
+                for key, explanation in st.session_state.cultural_explanations.items()
+            ), unsafe_allow_html=True)
     
     # Story completion check
     if SessionManager.is_story_complete():
@@ -944,7 +717,7 @@ def show_story_interface():
     
     # Enhanced branching options
     if st.session_state.branching_options:
-        show_branching_options()
+        show_branching_options(stream_slot)
     
     # Enhanced continuation interface
     st.markdown('<div class="section-header">Story Continuation</div>', unsafe_allow_html=True)
@@ -967,7 +740,7 @@ def show_story_interface():
         if st.button("CONTINUE STORY", key="continue_story_button", disabled=not user_input.strip(), use_container_width=True):
             try:
                 with st.spinner("Continuing your story..."):
-                    continue_story(user_input)
+                    continue_story(user_input, placeholder=stream_slot)
             except Exception as e:
                 st.error(f"Failed to continue story: {str(e)}")
     
@@ -987,7 +760,7 @@ def show_story_interface():
             except Exception as e:
                 st.error(f"Failed to enhance culture: {str(e)}")
 
-def show_branching_options():
+def show_branching_options(placeholder=None):
     """Display branching narrative options."""
     if not st.session_state.branching_options:
         return
@@ -1011,11 +784,11 @@ def show_branching_options():
             if st.button(f"CHOOSE {i+1}", key=f"branch_{i}", use_container_width=True):
                 try:
                     with st.spinner("Continuing with your choice..."):
-                        continue_story(option, is_branching_choice=True)
+                        continue_story(option, is_branching_choice=True, placeholder=placeholder)
                 except Exception as e:
                     st.error(f"Failed to continue with choice: {str(e)}")
 
-def continue_story(user_input: str, is_branching_choice: bool = False):
+def continue_story(user_input: str, is_branching_choice: bool = False, placeholder=None):
     """Continue the story with user input and security measures."""
     
     # Security: Input validation
@@ -1035,7 +808,7 @@ def continue_story(user_input: str, is_branching_choice: bool = False):
     
     try:
         # Check if services are available
-        if not hasattr(st.session_state, 'perplexity_service'):
+        if 'perplexity_service' not in st.session_state:
             st.error("❌ Perplexity service not available. Please refresh the page.")
             return
         
@@ -1043,11 +816,20 @@ def continue_story(user_input: str, is_branching_choice: bool = False):
         if not is_branching_choice:
             SessionManager.add_story_entry(sanitized_input, "user")
         
+        # The Qloo lookup for the new input does not depend on the continuation,
+        # so it runs while Perplexity writes
+        culture_lookup = None
+        if 'qloo_service' in st.session_state:
+            culture_lookup = lookup_new_culture(sanitized_input)
+        
         # Get AI continuation
-        result = st.session_state.perplexity_service.continue_story(
-            st.session_state.story_history,
-            sanitized_input,
-            st.session_state.cultural_context
+        service = st.session_state.perplexity_service
+        story_history = st.session_state.story_history
+        cultural_context = st.session_state.cultural_context
+        result = stream_story_text(
+            lambda: service.stream_continue_story(story_history, sanitized_input, cultural_context),
+            lambda: service.continue_story(story_history, sanitized_input, cultural_context),
+            placeholder
         )
         
         if result["success"]:
@@ -1055,17 +837,23 @@ def continue_story(user_input: str, is_branching_choice: bool = False):
             sanitized_content = sanitize_text(result["content"])
             
             SessionManager.add_story_entry(sanitized_content, "ai")
-            SessionManager.increment_turn()
+            if not result.get("truncated"):
+                SessionManager.increment_turn()
             
             # Clear branching options and input
             st.session_state.branching_options = []
             
             # Enhance with new cultural context if entities found
             try:
-                enhance_story_with_new_culture(sanitized_input)
+                enhance_story_with_new_culture(sanitized_input, culture_lookup)
             except Exception as e:
                 st.warning(f"Cultural enhancement failed: {str(e)}")
             
+            if result.get("truncated"):
+                # No rerun, so the warning stays next to the cut-off passage
+                st.warning(TRUNCATED_WARNING)
+                return
+            prefetch_branching_options()
             st.success("Story continued successfully!")
             st.rerun()
         else:
@@ -1080,16 +868,25 @@ def generate_branching_options():
     """Generate branching narrative options."""
     try:
         # Check if services are available
-        if not hasattr(st.session_state, 'perplexity_service'):
+        if 'perplexity_service' not in st.session_state:
             st.error("❌ Perplexity service not available. Please refresh the page.")
             return
         
         current_story = SessionManager.get_story_text()
+        # From now on this session gets its options prefetched after each turn
+        st.session_state.options_requested = True
         
-        result = st.session_state.perplexity_service.generate_branching_options(
-            current_story,
-            st.session_state.cultural_context
-        )
+        # Use the options prefetched after the last turn when they still match
+        result = None
+        prefetch = st.session_state.pop('options_prefetch', None)
+        if prefetch and prefetch[0] == (current_story, st.session_state.cultural_context):
+            result = prefetch[1].result()
+        
+        if not result or not result["success"]:
+            result = st.session_state.perplexity_service.generate_branching_options(
+                current_story,
+                st.session_state.cultural_context
+            )
         
         if result["success"]:
             st.session_state.branching_options = result["options"]
@@ -1103,11 +900,32 @@ def generate_branching_options():
         st.error(f"❌ Unexpected error: {str(e)}")
         st.write("Please check your internet connection and try again.")
 
+def prefetch_branching_options():
+    """Start generating branching options for the current story in the background.
+    
+    Each prefetch is a billed completion that cannot be stopped once it has
+    started, so it only runs for sessions that have asked for options before
+    and never for a finished story, which does not show them.
+    """
+    if not st.session_state.get('options_requested') or SessionManager.is_story_complete():
+        return
+    
+    previous = st.session_state.get('options_prefetch')
+    if previous:
+        previous[1].cancel()  # Only stops it if it has not started yet
+    
+    service = st.session_state.perplexity_service
+    current_story = SessionManager.get_story_text()
+    cultural_context = st.session_state.cultural_context
+    
+    future = service.submit(service.generate_branching_options, current_story, cultural_context)
+    st.session_state.options_prefetch = ((current_story, cultural_context), future)
+
 def enhance_with_culture():
     """Enhance story with additional cultural context."""
     try:
         # Check if services are available
-        if not hasattr(st.session_state, 'qloo_service'):
+        if 'qloo_service' not in st.session_state:
             st.error("❌ Qloo service not available. Please refresh the page.")
             return
         
@@ -1140,12 +958,20 @@ def enhance_with_culture():
         st.error(f"❌ Cultural enhancement failed: {str(e)}")
         st.write("Please check your internet connection and try again.")
 
-def enhance_story_with_new_culture(user_input: str):
+def lookup_new_culture(user_input: str) -> Optional[Future]:
+    """Start the Qloo cultural context lookup for new user input in the background."""
+    qloo_service = st.session_state.qloo_service
+    if not qloo_service.extract_entities_from_text(user_input):
+        return None
+    return qloo_service.submit(qloo_service.create_cultural_context, user_input)
+
+def enhance_story_with_new_culture(user_input: str, lookup: Optional[Future] = None):
     """Automatically enhance story with cultural context from new user input."""
-    entities = st.session_state.qloo_service.extract_entities_from_text(user_input)
+    if lookup is None:
+        lookup = lookup_new_culture(user_input)
     
-    if entities:
-        new_context = st.session_state.qloo_service.create_cultural_context(user_input)
+    if lookup is not None:
+        new_context = lookup.result()
         
         if new_context:
             current_context = st.session_state.cultural_context
@@ -1159,6 +985,20 @@ def enhance_story_with_new_culture(user_input: str):
                     f"Cultural elements from your input: {new_context}"
                 )
 
+def story_pdf_bytes(story_data: Dict) -> bytes:
+    """Return the story as PDF bytes, rebuilding them only when the story has changed."""
+    # The export timestamp changes on every call; everything else identifies the story
+    content = {key: value for key, value in story_data.items() if key != 'export_timestamp'}
+    digest = hashlib.blake2b(orjson.dumps(content, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+    
+    cached = st.session_state.get('pdf_cache')
+    if cached and cached[0] == digest:
+        return cached[1]
+    
+    pdf_bytes = ExportUtils.create_story_pdf(story_data)
+    st.session_state.pdf_cache = (digest, pdf_bytes)
+    return pdf_bytes
+
 def show_export_options():
     """Display export and sharing options."""
     st.markdown('<div class="section-header">Export & Share</div>', unsafe_allow_html=True)
@@ -1167,30 +1007,27 @@ def show_export_options():
     
     col1, col2, col3 = st.columns(3)
     
+    # Download buttons carry their data directly, so one click saves the file
     with col1:
-        if st.button("Download Text", key="download_text_button"):
-            text_content = ExportUtils.create_story_text(story_data)
-            st.download_button(
-                label="Download Story.txt",
-                data=text_content,
-                file_name=f"narravox_story_{story_data['session_id'][:8]}.txt",
-                mime="text/plain"
-            )
+        st.download_button(
+            label="Download Story.txt",
+            data=ExportUtils.create_story_text(story_data),
+            file_name=f"narravox_story_{story_data['session_id'][:8]}.txt",
+            mime="text/plain",
+            key="download_text_button"
+        )
     
     with col2:
-        if st.button("Download PDF", key="download_pdf_button"):
-            try:
-                pdf_path = ExportUtils.create_story_pdf(story_data)
-                with open(pdf_path, "rb") as pdf_file:
-                    st.download_button(
-                        label="Download Story.pdf",
-                        data=pdf_file.read(),
-                        file_name=f"narravox_story_{story_data['session_id'][:8]}.pdf",
-                        mime="application/pdf"
-                    )
-                # Cleanup is handled by create_story_pdf if it uses a temporary file
-            except Exception as e:
-                st.error(f"PDF generation failed: {str(e)}")
+        try:
+            st.download_button(
+                label="Download Story.pdf",
+                data=story_pdf_bytes(story_data),
+                file_name=f"narravox_story_{story_data['session_id'][:8]}.pdf",
+                mime="application/pdf",
+                key="download_pdf_button"
+            )
+        except Exception as e:
+            st.error(f"PDF generation failed: {str(e)}")
     
     with col3:
         if st.button("Copy Share Link", key="copy_share_link_button"):
@@ -1198,35 +1035,48 @@ def show_export_options():
             st.code(share_link)
             st.info("Link copied! (Feature will be available after deployment)")
 
-def surprise_continuation():
-    """Generate a surprise story with random cultural elements."""
-    surprise_prompts = [
-        "A cyberpunk detective in Neo-Tokyo discovers jazz music holds the key to solving crimes",
-        "A vintage vinyl collector in Paris finds love through shared passion for indie music",
-        "A classical musician in Vienna discovers hip-hop culture changes their perspective on tradition",
-        "A street artist in Berlin combines graffiti with ancient calligraphy techniques",
-        "A tea ceremony master in Kyoto incorporates modern electronic music into traditional rituals",
-        "A fashion designer in Milan finds inspiration in ancient tribal patterns and modern streetwear",
-        "A chef in New Orleans blends Creole traditions with molecular gastronomy",
-        "A photographer in Morocco captures the intersection of traditional markets and digital commerce"
-    ]
+# Surprise story prompts
+SURPRISE_PROMPTS = (
+    "A cyberpunk detective in Neo-Tokyo discovers jazz music holds the key to solving crimes",
+    "A vintage vinyl collector in Paris finds love through shared passion for indie music",
+    "A classical musician in Vienna discovers hip-hop culture changes their perspective on tradition",
+    "A street artist in Berlin combines graffiti with ancient calligraphy techniques",
+    "A tea ceremony master in Kyoto incorporates modern electronic music into traditional rituals",
+    "A fashion designer in Milan finds inspiration in ancient tribal patterns and modern streetwear",
+    "A chef in New Orleans blends Creole traditions with molecular gastronomy",
+    "A photographer in Morocco captures the intersection of traditional markets and digital commerce"
+)
+
+def prefetch_surprise():
+    """Pick the next surprise prompt and warm its Qloo context in the background."""
+    if 'next_surprise' in st.session_state or 'qloo_service' not in st.session_state:
+        return
     
-    import random
-    surprise_prompt = random.choice(surprise_prompts)
-    create_story_opener(surprise_prompt)
+    surprise_prompt = random.choice(SURPRISE_PROMPTS)
+    st.session_state.next_surprise = surprise_prompt
+    
+    # Fire and forget: the result lands in the service's response cache
+    qloo_service = st.session_state.qloo_service
+    qloo_service.submit(qloo_service.create_cultural_context, sanitize_text(surprise_prompt))
+
+def surprise_continuation(placeholder=None):
+    """Generate a surprise story with random cultural elements."""
+    surprise_prompt = st.session_state.pop('next_surprise', None) or random.choice(SURPRISE_PROMPTS)
+    create_story_opener(surprise_prompt, placeholder=placeholder)
+
+# Demo examples as (button title, prompt)
+DEMO_EXAMPLES = (
+    ("CYBERPUNK + JAZZ", "A cyberpunk thriller with jazz influences in Neo-Tokyo"),
+    ("ROMANCE + VINYL", "A romantic comedy involving vintage vinyl records and food trucks"),
+    ("FANTASY + HIP-HOP", "A fantasy adventure combining Norse mythology with modern hip-hop culture"),
+    ("SCI-FI + CLASSICAL", "A space opera where classical music holds the key to interstellar communication")
+)
 
 def show_demo_examples():
     """Show demo examples for quick testing."""
     st.markdown("**Quick Start Examples:**")
     
-    examples = [
-        ("CYBERPUNK + JAZZ", "A cyberpunk thriller with jazz influences in Neo-Tokyo"),
-        ("ROMANCE + VINYL", "A romantic comedy involving vintage vinyl records and food trucks"),
-        ("FANTASY + HIP-HOP", "A fantasy adventure combining Norse mythology with modern hip-hop culture"),
-        ("SCI-FI + CLASSICAL", "A space opera where classical music holds the key to interstellar communication")
-    ]
-    
-    for title, example in examples:
+    for title, example in DEMO_EXAMPLES:
         if st.button(title, key=f"demo_{title}", use_container_width=True):
             # Reset session and start with example
             SessionManager.reset_session()
@@ -6,7 +6,9 @@ Fixes common Streamlit server issues and CSP problems
 import os
 import sys
 import subprocess
-from pathlib import Path
+from importlib.util import find_spec
+
+REQUIRED_MODULES = ('streamlit', 'requests', 'dotenv', 'reportlab')
 
 def setup_environment():
     """Set up environment variables for the server."""
@@ -47,16 +49,15 @@ def setup_environment():
 
 def check_dependencies():
     """Check if required dependencies are installed."""
-    try:
-        import streamlit
-        import requests
-        from dotenv import load_dotenv
-        import reportlab
-        print("✓ All dependencies available")
-        return True
-    except ImportError as e:
-        print(f"✗ Missing dependency: {e}")
+    # Only locate the packages: the server runs in its own process, so importing
+    # streamlit and reportlab here would just slow the launcher down
+    missing = [name for name in REQUIRED_MODULES if find_spec(name) is None]
+    if missing:
+        print(f"✗ Missing dependency: {', '.join(missing)}")
         return False
+    
+    print("✓ All dependencies available")
+    return True
 
 def start_streamlit_server():
     """Start the Streamlit server with proper configuration."""
@@ -90,7 +91,7 @@ def main():
     print("=" * 50)
     
     # Check if we're in the right directory
-    if not Path('app.py').exists():
+    if not os.path.exists('app.py'):
         print("✗ app.py not found. Please run from the Narravox project directory.")
         sys.exit(1)
     
@@ -1,12 +1,72 @@
-import os
 from datetime import datetime
-from typing import Dict
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib.colors import black, Color
-import tempfile
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, Tuple
+
+@lru_cache(maxsize=1)
+def _pdf_styles() -> Tuple:
+    """Build the PDF paragraph styles once; they are only read while building."""
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.colors import black, Color
+    
+    # Define styles following Swiss Design principles
+    styles = getSampleStyleSheet()
+    
+    # Custom styles for Swiss Design
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=black,
+        fontName='Helvetica-Bold',
+        alignment=0  # Left align
+    )
+    
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        spaceAfter=12,
+        spaceBefore=20,
+        textColor=black,
+        fontName='Helvetica-Bold',
+        alignment=0
+    )
+    
+    body_style = ParagraphStyle(
+        'CustomBody',
+        parent=styles['Normal'],
+        fontSize=11,
+        spaceAfter=10,
+        textColor=black,
+        fontName='Helvetica',
+        alignment=0,
+        leftIndent=0,
+        rightIndent=0
+    )
+    
+    meta_style = ParagraphStyle(
+        'CustomMeta',
+        parent=styles['Normal'],
+        fontSize=9,
+        spaceAfter=8,
+        textColor=Color(0.4, 0.4, 0.4),  # Gray
+        fontName='Helvetica',
+        alignment=0
+    )
+    
+    # Speaker labels
+    speaker_style = ParagraphStyle(
+        'Speaker',
+        parent=body_style,
+        fontSize=10,
+        fontName='Helvetica-Bold',
+        spaceAfter=5,
+        textColor=Color(0.3, 0.3, 0.3)
+    )
+    
+    return title_style, heading_style, body_style, meta_style, speaker_style
 
 class ExportUtils:
     """Utilities for exporting stories in various formats."""
@@ -14,163 +74,106 @@ class ExportUtils:
     @staticmethod
     def create_story_text(story_data: Dict) -> str:
         """Create formatted text version of the story."""
-        lines = []
-        
-        # Header
-        lines.append("NARRAVOX STORY")
-        lines.append("=" * 50)
-        lines.append(f"Session ID: {story_data.get('session_id', 'Unknown')}")
-        lines.append(f"Created: {story_data.get('export_timestamp', 'Unknown')}")
-        lines.append(f"Turns: {story_data.get('turn_count', 0)}")
-        lines.append("")
+        # Lines joined with newlines; fixed-layout sections go in as one multi-line
+        # f-string each, ending in a newline so a blank line follows them
+        lines = [
+            f"NARRAVOX STORY\n{'=' * 50}\n"
+            f"Session ID: {story_data.get('session_id', 'Unknown')}\n"
+            f"Created: {story_data.get('export_timestamp', 'Unknown')}\n"
+            f"Turns: {story_data.get('turn_count', 0)}\n"
+        ]
         
         # Cultural context if available
-        if story_data.get('cultural_context'):
-            lines.append("CULTURAL CONTEXT:")
-            lines.append("-" * 20)
-            lines.append(story_data['cultural_context'])
-            lines.append("")
+        cultural_context = story_data.get('cultural_context')
+        if cultural_context:
+            lines.append(f"CULTURAL CONTEXT:\n{'-' * 20}\n{cultural_context}\n")
         
         # Story content
-        lines.append("STORY:")
-        lines.append("-" * 20)
-        lines.append("")
+        lines.append(f"STORY:\n{'-' * 20}\n")
         
         # Add story entries
         for entry in story_data.get('story_history', []):
             if entry['type'] in ['user', 'ai']:
-                speaker = "YOU" if entry['type'] == 'user' else "AI"
-                lines.append(f"[{speaker}]")
+                lines.append("[YOU]" if entry['type'] == 'user' else "[AI]")
                 lines.append(entry['content'])
                 lines.append("")
         
         # Cultural explanations if available
-        if story_data.get('cultural_explanations'):
-            lines.append("CULTURAL INSIGHTS:")
-            lines.append("-" * 20)
-            for key, explanation in story_data['cultural_explanations'].items():
+        cultural_explanations = story_data.get('cultural_explanations')
+        if cultural_explanations:
+            lines.append(f"CULTURAL INSIGHTS:\n{'-' * 20}")
+            for key, explanation in cultural_explanations.items():
                 lines.append(f"{key}: {explanation}")
             lines.append("")
         
         return "\n".join(lines)
     
     @staticmethod
-    def create_story_pdf(story_data: Dict) -> str:
-        """Create PDF version of the story and return file path."""
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        temp_file.close()
+    def create_story_pdf(story_data: Dict) -> bytes:
+        """Create PDF version of the story and return its bytes."""
+        # ReportLab takes ~140ms to import; only pay for it when a PDF is requested
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+        
+        # The document is written to memory; the caller only ever needs the bytes
+        buffer = BytesIO()
         
         try:
             # Create PDF document
-            doc = SimpleDocTemplate(temp_file.name, pagesize=letter)
-            
-            # Define styles following Swiss Design principles
-            styles = getSampleStyleSheet()
-            
-            # Custom styles for Swiss Design
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=24,
-                spaceAfter=30,
-                textColor=black,
-                fontName='Helvetica-Bold',
-                alignment=0  # Left align
-            )
-            
-            heading_style = ParagraphStyle(
-                'CustomHeading',
-                parent=styles['Heading2'],
-                fontSize=14,
-                spaceAfter=12,
-                spaceBefore=20,
-                textColor=black,
-                fontName='Helvetica-Bold',
-                alignment=0
-            )
-            
-            body_style = ParagraphStyle(
-                'CustomBody',
-                parent=styles['Normal'],
-                fontSize=11,
-                spaceAfter=10,
-                textColor=black,
-                fontName='Helvetica',
-                alignment=0,
-                leftIndent=0,
-                rightIndent=0
-            )
+            doc = SimpleDocTemplate(buffer, pagesize=letter)
             
-            meta_style = ParagraphStyle(
-                'CustomMeta',
-                parent=styles['Normal'],
-                fontSize=9,
-                spaceAfter=8,
-                textColor=Color(0.4, 0.4, 0.4),  # Gray
-                fontName='Helvetica',
-                alignment=0
-            )
+            # Styles following Swiss Design principles, shared by every export
+            title_style, heading_style, body_style, meta_style, speaker_style = _pdf_styles()
             
             # Build PDF content
             story = []
             
             # Title
-            story.append(Paragraph("NARRAVOX STORY", title_style))
-            story.append(Spacer(1, 12))
+            story.extend((Paragraph("NARRAVOX STORY", title_style), Spacer(1, 12)))
             
             # Metadata
-            story.append(Paragraph(f"Session ID: {story_data.get('session_id', 'Unknown')}", meta_style))
-            story.append(Paragraph(f"Created: {story_data.get('export_timestamp', 'Unknown')}", meta_style))
-            story.append(Paragraph(f"Turns: {story_data.get('turn_count', 0)}", meta_style))
-            story.append(Spacer(1, 20))
+            story.extend((
+                Paragraph(f"Session ID: {story_data.get('session_id', 'Unknown')}", meta_style),
+                Paragraph(f"Created: {story_data.get('export_timestamp', 'Unknown')}", meta_style),
+                Paragraph(f"Turns: {story_data.get('turn_count', 0)}", meta_style),
+                Spacer(1, 20)
+            ))
             
             # Cultural context
-            if story_data.get('cultural_context'):
-                story.append(Paragraph("CULTURAL CONTEXT", heading_style))
-                story.append(Paragraph(story_data['cultural_context'], body_style))
-                story.append(Spacer(1, 15))
+            cultural_context = story_data.get('cultural_context')
+            if cultural_context:
+                story.extend((
+                    Paragraph("CULTURAL CONTEXT", heading_style),
+                    Paragraph(cultural_context, body_style),
+                    Spacer(1, 15)
+                ))
             
             # Story content
-            story.append(Paragraph("STORY", heading_style))
-            story.append(Spacer(1, 10))
+            story.extend((Paragraph("STORY", heading_style), Spacer(1, 10)))
             
             for entry in story_data.get('story_history', []):
                 if entry['type'] in ['user', 'ai']:
-                    speaker = "YOU" if entry['type'] == 'user' else "AI"
-                    
-                    # Speaker label
-                    speaker_style = ParagraphStyle(
-                        'Speaker',
-                        parent=body_style,
-                        fontSize=10,
-                        fontName='Helvetica-Bold',
-                        spaceAfter=5,
-                        textColor=Color(0.3, 0.3, 0.3)
-                    )
-                    
-                    story.append(Paragraph(f"[{speaker}]", speaker_style))
-                    story.append(Paragraph(entry['content'], body_style))
-                    story.append(Spacer(1, 15))
+                    # Speaker label, content and spacing
+                    story.extend((
+                        Paragraph("[YOU]" if entry['type'] == 'user' else "[AI]", speaker_style),
+                        Paragraph(entry['content'], body_style),
+                        Spacer(1, 15)
+                    ))
             
             # Cultural explanations
-            if story_data.get('cultural_explanations'):
-                story.append(Spacer(1, 20))
-                story.append(Paragraph("CULTURAL INSIGHTS", heading_style))
+            cultural_explanations = story_data.get('cultural_explanations')
+            if cultural_explanations:
+                story.extend((Spacer(1, 20), Paragraph("CULTURAL INSIGHTS", heading_style)))
                 
-                for key, explanation in story_data['cultural_explanations'].items():
-                    story.append(Paragraph(f"<b>{key}:</b> {explanation}", body_style))
-                    story.append(Spacer(1, 8))
+                for key, explanation in cultural_explanations.items():
+                    story.extend((Paragraph(f"<b>{key}:</b> {explanation}", body_style), Spacer(1, 8)))
             
             # Build PDF
             doc.build(story)
             
-            return temp_file.name
+            return buffer.getvalue()
             
         except Exception as e:
-            # Clean up on error
-            if os.path.exists(temp_file.name):
-                os.unlink(temp_file.name)
             raise Exception(f"PDF creation failed: {str(e)}")
     
     @staticmethod
@@ -193,16 +196,5 @@ class ExportUtils:
                 break
         
         # Truncate if needed
-        if len(story_text) > 200:
-            story_text = story_text[:197] + "..."
-        
-        return f'I created a story with Narravox: "{story_text}" Check it out!'
-    
-    @staticmethod
-    def cleanup_temp_file(file_path: str):
-        """Clean up temporary files."""
-        try:
-            if os.path.exists(file_path):
-                os.unlink(file_path)
-        except Exception:
-            pass  # Ignore cleanup errors 
\ No newline at end of file
+        excerpt = story_text if len(story_text) <= 200 else f"{story_text[:197]}..."
+        return f'I created a story with Narravox: "{excerpt}" Check it out!'
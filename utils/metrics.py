@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+
+class Metrics:
+    """Thread-safe in-process counters and sample distributions."""
+
+    def __init__(self, samples: int = 512):
+        self.samples = samples
+        self._counters: Dict[str, float] = {}
+        self._timings: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1) -> float:
+        """Add amount to the named counter and return its new total."""
+        with self._lock:
+            total = self._counters[name] = self._counters.get(name, 0) + amount
+            return total
+
+    def observe(self, name: str, value: float):
+        """Record one sample (a duration, a size), keeping only the most recent."""
+        with self._lock:
+            timings = self._timings.get(name)
+            if timings is None:
+                timings = self._timings[name] = deque(maxlen=self.samples)
+            timings.append(value)
+
+    @contextmanager
+    def time(self, name: str):
+        """Record how long the wrapped block takes under name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        """Return current counters plus count, p50 and p95 for each sample series."""
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: sorted(values) for name, values in self._timings.items()}
+
+        summary = {}
+        for name, values in timings.items():
+            if not values:
+                continue
+            summary[name] = {
+                "count": len(values),
+                "p50": values[int(0.50 * (len(values) - 1))],
+                "p95": values[int(0.95 * (len(values) - 1))]
+            }
+
+        return {"counters": counters, "timings": summary}
@@ -3,74 +3,62 @@ from datetime import datetime
 from typing import Dict, List, Optional, Any
 import streamlit as st
 
+# Session state defaults, applied by init_session on every rerun; factories give
+# each session its own lists and dicts
+_SESSION_DEFAULTS = (
+    ('session_id', lambda: str(uuid.uuid4())),
+    ('story_history', list),
+    ('current_story', str),
+    ('cultural_context', str),
+    ('cultural_context_preview', str),
+    ('turn_count', int),
+    ('user_preferences', dict),
+    ('story_started', bool),
+    ('last_error', lambda: None),
+    ('branching_options', list),
+    ('cultural_explanations', dict),
+    ('demo_mode', bool),
+    ('demo_prompt', str),
+    ('temp_prompt', str),
+    ('taste_suggestions', list)
+)
+
 class SessionManager:
     """Manages story sessions and user interactions."""
     
+    # Maximum allowed turns for a story
+    MAX_TURNS = 15
+    
     @staticmethod
     def init_session():
         """Initialize session state variables if they don't exist."""
-        if 'session_id' not in st.session_state:
-            st.session_state.session_id = str(uuid.uuid4())
-        
-        if 'story_history' not in st.session_state:
-            st.session_state.story_history = []
-        
-        if 'current_story' not in st.session_state:
-            st.session_state.current_story = ""
-        
-        if 'cultural_context' not in st.session_state:
-            st.session_state.cultural_context = ""
-        
-        if 'turn_count' not in st.session_state:
-            st.session_state.turn_count = 0
-        
-        if 'user_preferences' not in st.session_state:
-            st.session_state.user_preferences = {}
-        
-        if 'story_started' not in st.session_state:
-            st.session_state.story_started = False
-        
-        if 'last_error' not in st.session_state:
-            st.session_state.last_error = None
-        
-        if 'branching_options' not in st.session_state:
-            st.session_state.branching_options = []
-        
-        if 'cultural_explanations' not in st.session_state:
-            st.session_state.cultural_explanations = {}
-        
-        if 'demo_mode' not in st.session_state:
-            st.session_state.demo_mode = False
-        
-        if 'demo_prompt' not in st.session_state:
-            st.session_state.demo_prompt = ""
-        
-        if 'temp_prompt' not in st.session_state:
-            st.session_state.temp_prompt = ""
-        
-        if 'taste_suggestions' not in st.session_state:
-            st.session_state.taste_suggestions = []
+        state = st.session_state
+        for key, factory in _SESSION_DEFAULTS:
+            if key not in state:
+                state[key] = factory()
     
     @staticmethod
     def add_story_entry(content: str, entry_type: str, metadata: Dict = None):
         """Add an entry to the story history."""
+        # Each st.session_state attribute access goes through the proxy; bind it once
+        state = st.session_state
         entry = {
-            'id': str(uuid.uuid4()),
+            # Process-wide caches key on this (Perplexity history summaries), so it
+            # must be unique across sessions; .hex skips the hyphenated formatting
+            'id': uuid.uuid4().hex,
             'content': content,
             'type': entry_type,  # 'user', 'ai', 'system'
             'timestamp': datetime.now().isoformat(),
-            'turn': st.session_state.turn_count,
+            'turn': state.turn_count,
             'metadata': metadata or {}
         }
         
-        st.session_state.story_history.append(entry)
+        state.story_history.append(entry)
         
         # Update current story for display
         if entry_type in ['user', 'ai']:
-            if st.session_state.current_story:
-                st.session_state.current_story += f"\n\n{content}"
-            else:
-                st.session_state.current_story = content
+            current_story = state.current_story
+            state.current_story = f"{current_story}\n\n{content}" if current_story else content
     
     @staticmethod
     def increment_turn():
@@ -80,11 +68,12 @@ class SessionManager:
     @staticmethod
     def get_story_summary() -> str:
         """Get a summary of the current story for display."""
-        if not st.session_state.story_history:
+        history = st.session_state.story_history
+        if not history:
             return "No story started yet."
         
         story_parts = []
-        for entry in st.session_state.story_history:
+        for entry in history:
             if entry['type'] in ['user', 'ai']:
                 prefix = "User: " if entry['type'] == 'user' else "AI: "
                 story_parts.append(f"{prefix}{entry['content']}")
@@ -109,32 +98,30 @@ class SessionManager:
     @staticmethod
     def export_story_data() -> Dict:
         """Export current story data for sharing or saving."""
+        state = st.session_state
         return {
-            'session_id': st.session_state.session_id,
-            'story_history': st.session_state.story_history,
-            'current_story': st.session_state.current_story,
-            'cultural_context': st.session_state.cultural_context,
-            'turn_count': st.session_state.turn_count,
-            'user_preferences': st.session_state.user_preferences,
+            'session_id': state.session_id,
+            'story_history': state.story_history,
+            'current_story': state.current_story,
+            'cultural_context': state.cultural_context,
+            'turn_count': state.turn_count,
+            'user_preferences': state.user_preferences,
             'export_timestamp': datetime.now().isoformat(),
-            'cultural_explanations': st.session_state.cultural_explanations
+            'cultural_explanations': state.cultural_explanations
         }
     
     @staticmethod
     def get_story_text() -> str:
         """Get clean story text for export."""
-        story_parts = []
-        
-        for entry in st.session_state.story_history:
-            if entry['type'] in ['user', 'ai']:
-                story_parts.append(entry['content'])
-        
-        return "\n\n".join(story_parts)
+        # add_story_entry keeps current_story as the joined user/AI content
+        return st.session_state.current_story
     
     @staticmethod
     def set_cultural_context(context: str):
         """Set cultural context for the session."""
         st.session_state.cultural_context = context
+        # The sidebar shows this on every rerun, so shorten it once here
+        st.session_state.cultural_context_preview = context[:100] + "..." if len(context) > 100 else context
     
     @staticmethod
     def add_cultural_explanation(key: str, explanation: str):
@@ -144,12 +131,12 @@ class SessionManager:
     @staticmethod
     def get_max_turns() -> int:
         """Get maximum allowed turns for a story."""
-        return 15
+        return SessionManager.MAX_TURNS
     
     @staticmethod
     def is_story_complete() -> bool:
         """Check if story has reached maximum turns."""
-        return st.session_state.turn_count >= SessionManager.get_max_turns()
+        return st.session_state.turn_count >= SessionManager.MAX_TURNS
     
     @staticmethod
     def set_error(error_message: str):
@@ -167,12 +154,13 @@ class SessionManager:
     @staticmethod
     def get_session_stats() -> Dict:
         """Get session statistics."""
+        state = st.session_state
         return {
-            'session_id': st.session_state.session_id,
-            'turns_completed': st.session_state.turn_count,
-            'max_turns': SessionManager.get_max_turns(),
-            'story_length': len(st.session_state.current_story),
-            'entries_count': len(st.session_state.story_history),
-            'has_cultural_context': bool(st.session_state.cultural_context),
-            'cultural_explanations_count': len(st.session_state.cultural_explanations)
+            'session_id': state.session_id,
+            'turns_completed': state.turn_count,
+            'max_turns': SessionManager.MAX_TURNS,
+            'story_length': len(state.current_story),
+            'entries_count': len(state.story_history),
+            'has_cultural_context': bool(state.cultural_context),
+            'cultural_explanations_count': len(state.cultural_explanations)
         } 
\ No newline at end of file